@@ -2,17 +2,232 @@
 
 from __future__ import annotations
 
+import functools
+import hashlib
 import json
 import logging
 import os
+import re
+import sqlite3
+import threading
+import time
+from contextlib import closing
 from pathlib import Path
-from typing import Any, Dict, Optional
+from typing import Any, Dict, Iterator, List, Mapping, Optional, Sequence, Tuple
+
+from database_setup import NARRATIVE_CACHE_TABLE_STATEMENT
 
 LOGGER = logging.getLogger(__name__)
 
 BASE_DIR = Path(__file__).resolve().parents[1]
 GUIDE_PATH = BASE_DIR / "configs" / "narrative_guide.txt"
 
+_TASK_INSTRUCTIONS = """**YOUR TASK:**
+
+1. Generate a COMPREHENSIVE, DETAILED narrative with proper paragraph structure:
+   - Paragraph 1: Demographics (age, sex, race, ethnicity, subject ID, site, study) - 2-3 sentences
+   - Paragraph 2: Concomitant medications (state "not available" if no data) - 1 sentence
+   - Paragraph 3: Study drug dosing leading up to event (use "most recent dose") - 2-3 sentences with specific dates and Study Day numbers
+   - Paragraph 4+: Event description (3-5 sentences):
+     * Opening sentence with date, Study Day, and event description
+     * Clinical presentation and symptoms (if applicable)
+     * Laboratory values with reference ranges (if applicable)
+     * Clinical course and interventions
+     * Outcome with date and Study Day
+   - Final: Action taken and causality assessment - 2 sentences
+
+2. Apply ALL guide conventions:
+   ✓ Use "year-old" (not "years-old" or "YEARS-old")
+   ✓ Proper case for race/ethnicity (e.g., "White Not Hispanic or Latino")
+   ✓ Lowercase preferred term after "SAE of"
+   ✓ Use "most recent dose" NEVER "last dose"
+   ✓ Add Study Day # ONLY for: onset date, stop date, dosing dates
+   ✓ Correct hospitalization phrasing per guide
+   ✓ Lowercase action_taken and causality in final sentence
+   ✓ Format dates as DD-MMM-YYYY
+   ✓ Add verbatim term in parentheses if different from PT
+
+3. For liver events (ALT/AST increased):
+   - Mention that laboratory values and ULN calculations would be included if baseline data were available
+   - Note this is a medically significant event
+
+4. Ensure natural flow while maintaining factual accuracy
+
+5. **IMPORTANT - ADD CLINICAL DETAIL:**
+   - For liver events: Include specific AST/ALT values if available in verbatim term
+   - Describe clinical significance (e.g., "representing Grade 3 hepatotoxicity")
+   - Add context about timing relative to treatment
+   - Include any relevant clinical assessments
+   - Make each paragraph substantive (not just 1 sentence)
+
+6. **TARGET LENGTH:** Aim for 250-400 words total (not 100 words)"""
+
+# Single-event user prompt, pre-rendered around the per-event data block.
+# The instructions come first so every request shares a long constant prefix.
+_USER_PROMPT_PREFIX = f"""Generate a COMPLETE patient safety narrative following the guide conventions exactly, using the event data at the end of this message.
+
+{_TASK_INSTRUCTIONS}
+
+**OUTPUT REQUIREMENTS:**
+{{output_format}}
+- No unresolved placeholders like {{{{field}}}}
+- Professional regulatory tone throughout
+- Each paragraph should be 2-5 sentences (not just 1 sentence)
+
+**EVENT DATA:**
+"""
+_USER_PROMPT_SUFFIX = "\n\nGenerate the comprehensive narrative now:"
+_STRUCTURED_OUTPUT_FORMAT = (
+    "- Fill each section of the response schema; "
+    "separate multiple event paragraphs with blank lines"
+)
+_TEXT_OUTPUT_FORMAT = """- Return ONLY the complete narrative text
+- Use double line breaks between paragraphs
+- No commentary, explanations, or meta-text"""
+
+
+# Prompt data categories, listed in the order they are presented.
+DEMOGRAPHIC_FIELDS = (
+    "age", "sex", "race", "ethnicity", "subject_id", "site_id", "study_id"
+)
+TREATMENT_FIELDS = ("actual_treatment", "first_dose_date", "last_dose_date")
+EVENT_DETAIL_FIELDS = (
+    "verbatim_term", "preferred_term", "start_date", "end_date",
+    "study_day_start", "study_day_end", "severity_grade", "outcome",
+    "action_taken", "causality", "analysis_causality", "hospitalization",
+    "life_threatening", "results_in_death", "other_medically_important",
+    "serious_event", "soc",
+)
+
+NARRATIVE_SECTIONS = (
+    "demographics",
+    "concomitant_medications",
+    "study_drug_dosing",
+    "event_description",
+    "action_and_causality",
+)
+
+# Structured Outputs schema: one string per narrative section, in order.
+NARRATIVE_RESPONSE_FORMAT: Dict[str, Any] = {
+    "type": "json_schema",
+    "json_schema": {
+        "name": "narrative_sections",
+        "strict": True,
+        "schema": {
+            "type": "object",
+            "properties": {name: {"type": "string"} for name in NARRATIVE_SECTIONS},
+            "required": list(NARRATIVE_SECTIONS),
+            "additionalProperties": False,
+        },
+    },
+}
+
+# Final chunk of an interrupted stream, so callers (and readers) can tell the
+# text is incomplete rather than saving it as a finished narrative.
+STREAM_INTERRUPTED_MARKER = "\n\n[NARRATIVE INCOMPLETE: OpenAI stream was interrupted]"
+
+# Completion-token ceiling of the default model; batched requests are split
+# so that ``max_tokens`` per request never exceeds it.
+MAX_OUTPUT_TOKENS = 16384
+
+_GUIDE_DECORATION = re.compile(r"\*\*|[\u2705\u274c]\s*")
+
+
+def _compact_guide(text: str) -> str:
+    """Drop markdown emphasis, emoji markers, table rules and blank lines.
+
+    Every rule, example and sentence template line is kept; only tokens that
+    carry no meaning for the model are removed.
+    """
+    lines = []
+    for line in text.splitlines():
+        line = _GUIDE_DECORATION.sub("", line).strip()
+        if not line or set(line) <= set("|-: "):
+            continue
+        lines.append(line)
+    return "\n".join(lines)
+
+
+@functools.lru_cache(maxsize=4)
+def _load_guide_cached(path: Path) -> str:
+    """Load the narrative writing guide in compact form (cached per path).
+
+    A pre-minimized ``<name>.min.txt`` next to the guide is used verbatim
+    when present; otherwise the full guide is compacted at load time.
+    Raises ``OSError`` when no guide can be read; ``lru_cache`` does not
+    store exceptions, so a guide added later is picked up on the next load.
+    """
+    minimized_path = path.with_suffix(".min.txt")
+    if minimized_path.exists():
+        guide_text = minimized_path.read_text(encoding="utf-8")
+        LOGGER.info("Loaded minimized narrative guide from %s (%d chars)", minimized_path, len(guide_text))
+        return guide_text
+    full_text = path.read_text(encoding="utf-8")
+    guide_text = _compact_guide(full_text)
+    LOGGER.info(
+        "Loaded narrative guide from %s (%d chars, %d after compaction)",
+        path,
+        len(full_text),
+        len(guide_text),
+    )
+    return guide_text
+
+
+def _load_guide(path: Path) -> str:
+    """Return the cached guide, or "" (uncached) when it cannot be loaded."""
+    try:
+        return _load_guide_cached(path)
+    except Exception as exc:
+        LOGGER.warning("Narrative guide not loaded from %s (%s); enhancing without it.", path, exc)
+        return ""
+
+
+@functools.lru_cache(maxsize=4)
+def _build_system_prompt_cached(guide_text: str) -> str:
+    """Build comprehensive system prompt with guide (cached per guide text)."""
+    return f"""You are an expert medical writer specializing in clinical adverse event narratives for regulatory submissions (FDA, EMA). You have deep expertise in:
+
+- Clinical trial safety reporting
+- ICH E2B/E2C guidelines
+- MedDRA terminology
+- Regulatory writing conventions
+- Medical terminology and clinical assessment
+
+You write complete, accurate, compliant narratives that follow sponsor-specific writing guides exactly.
+
+**YOUR NARRATIVE WRITING GUIDE:**
+{guide_text}
+
+**CRITICAL RULES:**
+1. Follow the guide conventions EXACTLY - this is non-negotiable
+2. Never invent data not provided in structured fields
+3. Use proper medical terminology and regulatory language
+4. Maintain factual accuracy above all else
+5. Generate complete narratives with all required paragraphs
+6. Apply all formatting rules (dates, capitalization, phrasing)
+"""
+
+
+class _RequestThrottle:
+    """Thread-safe requests-per-minute limiter shared by concurrent calls."""
+
+    def __init__(self, requests_per_minute: Optional[int] = None) -> None:
+        self.interval = 60.0 / requests_per_minute if requests_per_minute else 0.0
+        self._lock = threading.Lock()
+        self._next_slot = 0.0
+
+    def wait(self) -> None:
+        """Block until the next request slot is available."""
+        if not self.interval:
+            return
+        with self._lock:
+            now = time.monotonic()
+            slot = max(now, self._next_slot)
+            self._next_slot = slot + self.interval
+        delay = slot - now
+        if delay > 0:
+            time.sleep(delay)
+
 
 class OpenAINarrativeEnhancer:
     """Enhance narratives using OpenAI with comprehensive narrative guide."""
@@ -20,41 +235,51 @@ class OpenAINarrativeEnhancer:
     def __init__(
         self,
         model: str = "gpt-4o",
-        temperature: float = 0.3,
+        temperature: float = 0.0,
         max_tokens: int = 3000,
+        seed: Optional[int] = 42,
         client: Optional[Any] = None,
         guide_path: Optional[Path] = None,
+        requests_per_minute: Optional[int] = None,
+        max_retries: int = 5,
+        cache_db_path: Optional[Path | str] = None,
+        max_output_tokens: int = MAX_OUTPUT_TOKENS,
     ) -> None:
         self.model = model
         self.temperature = temperature
         self.max_tokens = max_tokens
+        self.max_output_tokens = max_output_tokens
+        self.seed = seed
         self.client = client or self._build_client()
+        self.max_retries = max_retries
+        self._throttle = _RequestThrottle(requests_per_minute)
+        self.cache_db_path = Path(cache_db_path) if cache_db_path else None
+        if self.cache_db_path is not None:
+            self._ensure_cache_table()
         
         # Load narrative guide
-        self.guide_path = guide_path or GUIDE_PATH
-        self.narrative_guide = self._load_guide()
+        self.guide_path = Path(guide_path or GUIDE_PATH)
+        self.narrative_guide = _load_guide(self.guide_path)
+        self.guide_hash = hashlib.sha256(self.narrative_guide.encode("utf-8")).hexdigest()
+        # Stable per guide version so OpenAI routes requests sharing the
+        # guide-heavy system prompt to the same prompt cache.
+        self.prompt_cache_key = "narrative-guide-" + self.guide_hash[:12]
+        # Render the input-independent part of the user prompt once.
+        self._structured_prompt_prefix = _USER_PROMPT_PREFIX.format_map(
+            {"output_format": _STRUCTURED_OUTPUT_FORMAT}
+        )
+        self._text_prompt_prefix = _USER_PROMPT_PREFIX.format_map(
+            {"output_format": _TEXT_OUTPUT_FORMAT}
+        )
         
         LOGGER.info(
-            "Initialized OpenAINarrativeEnhancer with model=%s, temperature=%.2f, max_tokens=%d",
+            "Initialized OpenAINarrativeEnhancer with model=%s, temperature=%.2f, max_tokens=%d, seed=%s",
             model,
             temperature,
             max_tokens,
+            seed,
         )
 
-    def _load_guide(self) -> str:
-        """Load the comprehensive narrative writing guide."""
-        try:
-            if self.guide_path.exists():
-                guide_text = self.guide_path.read_text(encoding="utf-8")
-                LOGGER.info("Loaded narrative guide from %s (%d chars)", self.guide_path, len(guide_text))
-                return guide_text
-            else:
-                LOGGER.warning("Narrative guide not found at %s", self.guide_path)
-                return ""
-        except Exception as e:
-            LOGGER.error("Failed to load narrative guide: %s", e)
-            return ""
-
     def enhance(
         self,
         field_values: Dict[str, Any],
@@ -72,25 +297,29 @@ class OpenAINarrativeEnhancer:
         Returns:
             Complete, guide-compliant narrative
         """
-        system_prompt = self._build_system_prompt()
-        user_prompt = self._build_comprehensive_user_prompt(field_values, baseline_text, template_id)
-        
-        messages = [
-            {"role": "system", "content": system_prompt},
-            {"role": "user", "content": user_prompt},
-        ]
+        cache_key = self._cache_key(field_values, template_id, baseline_text)
+        cached = self._cache_get(cache_key)
+        if cached is not None:
+            LOGGER.info("Using cached OpenAI narrative.")
+            return cached
+
+        messages = self._build_messages(field_values, baseline_text, template_id)
         
         try:
             LOGGER.info("Calling OpenAI for comprehensive narrative generation...")
-            response = self.client.chat.completions.create(
+            response = self._create_completion(
                 model=self.model,
                 messages=messages,
-                temperature=self.temperature,
                 max_tokens=self.max_tokens,
+                response_format=NARRATIVE_RESPONSE_FORMAT,
+                **self._sampling_params(),
             )
-            content = response.choices[0].message.content or baseline_text
+            content = self._join_sections(response.choices[0].message.content)
+            if not content:
+                return baseline_text
             LOGGER.info("OpenAI enhancement completed successfully.")
-            return content.strip()
+            self._cache_put(cache_key, content)
+            return content
             
         except Exception as exc:
             LOGGER.warning(
@@ -99,137 +328,479 @@ class OpenAINarrativeEnhancer:
             )
             return baseline_text
 
-    def _build_system_prompt(self) -> str:
-        """Build comprehensive system prompt with guide."""
-        return f"""You are an expert medical writer specializing in clinical adverse event narratives for regulatory submissions (FDA, EMA). You have deep expertise in:
+    def enhance_stream(
+        self,
+        field_values: Dict[str, Any],
+        template_id: str,
+        baseline_text: str,
+    ) -> Iterator[str]:
+        """
+        Stream a narrative from OpenAI as text chunks arrive.
 
-- Clinical trial safety reporting
-- ICH E2B/E2C guidelines
-- MedDRA terminology
-- Regulatory writing conventions
-- Medical terminology and clinical assessment
+        Yields the cached narrative in one piece on a cache hit, and the
+        baseline narrative if the request cannot be started. If the stream
+        breaks partway, ``STREAM_INTERRUPTED_MARKER`` is yielded last and
+        nothing is cached; callers should regenerate via ``enhance``.
+        """
+        cache_key = self._cache_key(field_values, template_id, baseline_text)
+        cached = self._cache_get(cache_key)
+        if cached is not None:
+            LOGGER.info("Using cached OpenAI narrative.")
+            yield cached
+            return
+
+        messages = self._build_messages(
+            field_values, baseline_text, template_id, structured=False
+        )
+        try:
+            LOGGER.info("Streaming OpenAI narrative generation...")
+            stream = self._create_completion(
+                model=self.model,
+                messages=messages,
+                max_tokens=self.max_tokens,
+                stream=True,
+                **self._sampling_params(),
+            )
+        except Exception as exc:
+            LOGGER.warning(
+                "OpenAI enhancement failed (%s). Falling back to baseline narrative.",
+                exc,
+            )
+            yield baseline_text
+            return
 
-You write complete, accurate, compliant narratives that follow sponsor-specific writing guides exactly.
+        parts: List[str] = []
+        try:
+            for chunk in stream:
+                if not chunk.choices:
+                    continue
+                delta = chunk.choices[0].delta.content
+                if delta:
+                    parts.append(delta)
+                    yield delta
+        except Exception as exc:
+            LOGGER.warning("OpenAI stream interrupted (%s); narrative is incomplete.", exc)
+            yield STREAM_INTERRUPTED_MARKER
+            return
+
+        content = "".join(parts).strip()
+        if content:
+            LOGGER.info("OpenAI streaming enhancement completed successfully.")
+            self._cache_put(cache_key, content)
+        else:
+            yield baseline_text
+
+    def enhance_batch(
+        self,
+        items: Sequence[Tuple[Dict[str, Any], str, str]],
+    ) -> List[str]:
+        """
+        Generate narratives for several events with as few OpenAI requests as fit.
 
-**YOUR NARRATIVE WRITING GUIDE:**
-{self.narrative_guide}
+        The guide-heavy system prompt is sent once per request rather than
+        once per event. Events are grouped so each request's ``max_tokens``
+        (``self.max_tokens`` per event) stays within ``max_output_tokens``.
+        Items missing from (or unparseable in) a model response are
+        regenerated individually via ``enhance``.
 
-**CRITICAL RULES:**
-1. Follow the guide conventions EXACTLY - this is non-negotiable
-2. Never invent data not provided in structured fields
-3. Use proper medical terminology and regulatory language
-4. Maintain factual accuracy above all else
-5. Generate complete narratives with all required paragraphs
-6. Apply all formatting rules (dates, capitalization, phrasing)
-"""
+        Args:
+            items: Sequence of ``(field_values, template_id, baseline_text)``
 
-    def _build_comprehensive_user_prompt(
+        Returns:
+            Narratives in the same order as ``items``
+        """
+        keys = [
+            self._cache_key(field_values, template_id, baseline_text)
+            for field_values, template_id, baseline_text in items
+        ]
+        results: List[Optional[str]] = [self._cache_get(key) for key in keys]
+        pending = [idx for idx, text in enumerate(results) if text is None]
+        per_request = max(1, self.max_output_tokens // self.max_tokens)
+        for start in range(0, len(pending), per_request):
+            chunk = pending[start : start + per_request]
+            if len(chunk) == 1:
+                results[chunk[0]] = self.enhance(*items[chunk[0]])
+                continue
+            parsed = self._request_batch([items[idx] for idx in chunk])
+            for position, idx in enumerate(chunk):
+                content = parsed.get(str(position))
+                if isinstance(content, str) and content.strip():
+                    results[idx] = content.strip()
+                    self._cache_put(keys[idx], results[idx])
+                else:
+                    results[idx] = self.enhance(*items[idx])
+        return results
+
+    def _request_batch(
+        self, batch: Sequence[Tuple[Dict[str, Any], str, str]]
+    ) -> Dict[str, Any]:
+        """Send one batch request; return narratives keyed by position, or {}."""
+        messages = [
+            {"role": "system", "content": self._build_system_prompt()},
+            {"role": "user", "content": self._build_batch_user_prompt(batch)},
+        ]
+        try:
+            LOGGER.info("Calling OpenAI for batch of %d narratives...", len(batch))
+            response = self._create_completion(
+                model=self.model,
+                messages=messages,
+                max_tokens=self.max_tokens * len(batch),
+                **self._sampling_params(),
+                response_format={"type": "json_object"},
+            )
+            parsed = json.loads(response.choices[0].message.content or "{}")
+            if not isinstance(parsed, dict):
+                raise ValueError("batch response is not a JSON object")
+            LOGGER.info("OpenAI batch enhancement completed successfully.")
+            return parsed
+        except Exception as exc:
+            LOGGER.warning(
+                "OpenAI batch enhancement failed (%s). Falling back to per-item requests.",
+                exc,
+            )
+            return {}
+
+    def enhance_many(
         self,
-        field_values: Dict[str, Any],
-        baseline_text: str,
-        template_id: str,
+        jobs: Sequence[Tuple[Dict[str, Any], str, str]],
+        max_concurrency: int = 8,
+    ) -> List[str]:
+        """
+        Enhance several narratives with concurrent, throttled requests.
+
+        Each job is a separate ``enhance`` call, so results match the
+        single-event path exactly; only the network waits overlap.
+
+        Args:
+            jobs: Sequence of ``(field_values, template_id, baseline_text)``
+            max_concurrency: Maximum number of in-flight requests
+
+        Returns:
+            Narratives in the same order as ``jobs``
+        """
+        from concurrent.futures import ThreadPoolExecutor
+
+        if not jobs:
+            return []
+        workers = max(1, min(max_concurrency, len(jobs)))
+        LOGGER.info(
+            "Enhancing %d narratives via OpenAI with %d workers.", len(jobs), workers
+        )
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            return list(
+                executor.map(
+                    lambda job: self.enhance(
+                        field_values=job[0],
+                        template_id=job[1],
+                        baseline_text=job[2],
+                    ),
+                    jobs,
+                )
+            )
+
+    def submit_batch(
+        self,
+        jobs: Mapping[str, Tuple[Dict[str, Any], str, str]],
     ) -> str:
-        """Build detailed user prompt with all available data."""
-        
-        # Organize fields by category
-        demographics = self._extract_category(field_values, [
-            "age", "sex", "race", "ethnicity", "subject_id", "site_id", "study_id"
-        ])
-        
-        treatment = self._extract_category(field_values, [
-            "actual_treatment", "first_dose_date", "last_dose_date"
-        ])
-        
-        event_details = self._extract_category(field_values, [
-            "verbatim_term", "preferred_term", "start_date", "end_date",
-            "study_day_start", "study_day_end", "severity_grade", "outcome",
-            "action_taken", "causality", "analysis_causality", "hospitalization",
-            "life_threatening", "results_in_death", "other_medically_important",
-            "serious_event", "soc"
-        ])
-        
-        prompt = f"""Generate a COMPLETE patient safety narrative following the guide conventions exactly.
+        """
+        Submit narratives to the OpenAI Batch API for offline processing.
 
-**TEMPLATE USED:** {template_id}
+        Args:
+            jobs: Mapping of custom id (e.g. ``"{subject}-{seq}"``) to
+                ``(field_values, template_id, baseline_text)``
 
-**BASELINE NARRATIVE (from simple templates):**
-{baseline_text}
+        Returns:
+            Identifier of the created batch, for use with ``poll_batch``
+        """
+        lines = [
+            json.dumps(
+                {
+                    "custom_id": custom_id,
+                    "method": "POST",
+                    "url": "/v1/chat/completions",
+                    "body": {
+                        "model": self.model,
+                        "messages": self._build_messages(
+                            field_values, baseline_text, template_id
+                        ),
+                        "max_tokens": self.max_tokens,
+                        "response_format": NARRATIVE_RESPONSE_FORMAT,
+                        **self._sampling_params(),
+                        "prompt_cache_key": self.prompt_cache_key,
+                    },
+                }
+            )
+            for custom_id, (field_values, template_id, baseline_text) in jobs.items()
+        ]
+        payload = ("\n".join(lines) + "\n").encode("utf-8")
+        input_file = self.client.files.create(
+            file=("narrative_batch.jsonl", payload), purpose="batch"
+        )
+        batch = self.client.batches.create(
+            input_file_id=input_file.id,
+            endpoint="/v1/chat/completions",
+            completion_window="24h",
+        )
+        LOGGER.info("Submitted OpenAI batch %s with %d narratives.", batch.id, len(lines))
+        return batch.id
 
-**ALL AVAILABLE STRUCTURED DATA:**
+    def poll_batch(self, batch_id: str) -> Optional[Dict[str, str]]:
+        """
+        Fetch results of a batch created by ``submit_batch``.
 
-Demographics:
-{self._format_dict(demographics)}
+        Returns:
+            Narratives keyed by custom id once the batch has completed, or
+            None while it is still running. Requests that failed inside the
+            batch are omitted so callers can fall back to the baseline text.
+        """
+        batch = self.client.batches.retrieve(batch_id)
+        if batch.status in ("failed", "expired", "cancelled"):
+            raise RuntimeError(f"OpenAI batch {batch_id} ended with status {batch.status}")
+        if batch.status != "completed":
+            LOGGER.info("OpenAI batch %s is %s.", batch_id, batch.status)
+            return None
+
+        results: Dict[str, str] = {}
+        # Failed requests go to the error file; a batch where every request
+        # failed has no output file at all.
+        for record in self._batch_records(batch.error_file_id):
+            self._log_batch_failure(record)
+        for record in self._batch_records(batch.output_file_id):
+            response = record.get("response") or {}
+            if response.get("status_code") != 200:
+                self._log_batch_failure(record)
+                continue
+            content = response["body"]["choices"][0]["message"]["content"]
+            results[record["custom_id"]] = self._join_sections(content)
+        LOGGER.info("OpenAI batch %s returned %d narratives.", batch_id, len(results))
+        return results
+
+    def _batch_records(self, file_id: Optional[str]) -> Iterator[Dict[str, Any]]:
+        """Yield the JSONL records of a batch result file, if there is one."""
+        if file_id is None:
+            return
+        for line in self.client.files.content(file_id).text.splitlines():
+            if line.strip():
+                yield json.loads(line)
 
-Treatment Information:
-{self._format_dict(treatment)}
+    @staticmethod
+    def _log_batch_failure(record: Dict[str, Any]) -> None:
+        response = record.get("response") or {}
+        LOGGER.warning(
+            "OpenAI batch request %s failed: %s",
+            record.get("custom_id"),
+            record.get("error") or response.get("body"),
+        )
 
-Event Details:
-{self._format_dict(event_details)}
+    def _cache_key(
+        self,
+        field_values: Dict[str, Any],
+        template_id: str,
+        baseline_text: str,
+    ) -> str:
+        """Fingerprint every input that influences the generated narrative."""
+        payload = {
+            "field_values": field_values,
+            "template_id": template_id,
+            "baseline_text": baseline_text,
+            "model": self.model,
+            "temperature": self.temperature,
+            "seed": self.seed,
+            "max_tokens": self.max_tokens,
+            "guide_hash": self.guide_hash,
+        }
+        encoded = json.dumps(payload, sort_keys=True, default=str).encode("utf-8")
+        return hashlib.sha256(encoded).hexdigest()
+
+    def _ensure_cache_table(self) -> None:
+        """Create the narrative cache table for databases built before it existed."""
+        try:
+            with closing(sqlite3.connect(self.cache_db_path)) as conn, conn:
+                conn.execute(NARRATIVE_CACHE_TABLE_STATEMENT)
+        except sqlite3.Error as exc:
+            LOGGER.warning("Narrative cache unavailable (%s); caching disabled.", exc)
+            self.cache_db_path = None
+
+    def _cache_get(self, key: str) -> Optional[str]:
+        """Return a previously generated narrative for ``key``, if cached."""
+        if self.cache_db_path is None:
+            return None
+        try:
+            with closing(sqlite3.connect(self.cache_db_path)) as conn:
+                row = conn.execute(
+                    "SELECT narrative FROM narrative_cache WHERE hash = ?", (key,)
+                ).fetchone()
+        except sqlite3.Error as exc:
+            LOGGER.warning("Narrative cache lookup failed: %s", exc)
+            return None
+        return row[0] if row else None
+
+    def _cache_put(self, key: str, narrative: str) -> None:
+        """Store a generated narrative under ``key``."""
+        if self.cache_db_path is None:
+            return
+        try:
+            with closing(sqlite3.connect(self.cache_db_path)) as conn, conn:
+                conn.execute(
+                    "INSERT OR REPLACE INTO narrative_cache (hash, narrative) VALUES (?, ?)",
+                    (key, narrative),
+                )
+        except sqlite3.Error as exc:
+            LOGGER.warning("Narrative cache write failed: %s", exc)
+
+    def _sampling_params(self) -> Dict[str, Any]:
+        """Decoding parameters shared by every request (deterministic by default)."""
+        params: Dict[str, Any] = {"temperature": self.temperature, "top_p": 1}
+        if self.seed is not None:
+            params["seed"] = self.seed
+        return params
+
+    def _build_messages(
+        self,
+        field_values: Dict[str, Any],
+        baseline_text: str,
+        template_id: str,
+        structured: bool = True,
+    ) -> List[Dict[str, str]]:
+        """Build the chat messages for a single narrative request."""
+        return [
+            {"role": "system", "content": self._build_system_prompt()},
+            {
+                "role": "user",
+                "content": self._build_comprehensive_user_prompt(
+                    field_values, baseline_text, template_id, structured=structured
+                ),
+            },
+        ]
 
-**YOUR TASK:**
+    def _create_completion(self, **kwargs: Any) -> Any:
+        """Call Chat Completions, backing off exponentially on rate limits."""
+        kwargs.setdefault("extra_body", {"prompt_cache_key": self.prompt_cache_key})
+        for attempt in range(self.max_retries + 1):
+            self._throttle.wait()
+            try:
+                return self.client.chat.completions.create(**kwargs)
+            except Exception as exc:
+                if getattr(exc, "status_code", None) != 429 or attempt == self.max_retries:
+                    raise
+                delay = 2 ** attempt
+                LOGGER.warning(
+                    "OpenAI rate limit hit; retrying in %ds (attempt %d/%d).",
+                    delay,
+                    attempt + 1,
+                    self.max_retries,
+                )
+                time.sleep(delay)
 
-1. Generate a COMPREHENSIVE, DETAILED narrative with proper paragraph structure:
-   - Paragraph 1: Demographics (age, sex, race, ethnicity, subject ID, site, study) - 2-3 sentences
-   - Paragraph 2: Concomitant medications (state "not available" if no data) - 1 sentence
-   - Paragraph 3: Study drug dosing leading up to event (use "most recent dose") - 2-3 sentences with specific dates and Study Day numbers
-   - Paragraph 4+: Event description (3-5 sentences):
-     * Opening sentence with date, Study Day, and event description
-     * Clinical presentation and symptoms (if applicable)
-     * Laboratory values with reference ranges (if applicable)
-     * Clinical course and interventions
-     * Outcome with date and Study Day
-   - Final: Action taken and causality assessment - 2 sentences
+    def _build_system_prompt(self) -> str:
+        """Build comprehensive system prompt with guide."""
+        return _build_system_prompt_cached(self.narrative_guide)
 
-2. Apply ALL guide conventions:
-   ✓ Use "year-old" (not "years-old" or "YEARS-old")
-   ✓ Proper case for race/ethnicity (e.g., "White Not Hispanic or Latino")
-   ✓ Lowercase preferred term after "SAE of"
-   ✓ Use "most recent dose" NEVER "last dose"
-   ✓ Add Study Day # ONLY for: onset date, stop date, dosing dates
-   ✓ Correct hospitalization phrasing per guide
-   ✓ Lowercase action_taken and causality in final sentence
-   ✓ Format dates as DD-MMM-YYYY
-   ✓ Add verbatim term in parentheses if different from PT
+    def _build_comprehensive_user_prompt(
+        self,
+        field_values: Dict[str, Any],
+        baseline_text: str,
+        template_id: str,
+        structured: bool = True,
+    ) -> str:
+        """Build detailed user prompt with all available data.
 
-3. For liver events (ALT/AST increased):
-   - Mention that laboratory values and ULN calculations would be included if baseline data were available
-   - Note this is a medically significant event
+        ``structured=False`` asks for plain narrative text instead of the
+        Structured Outputs sections (used when streaming).
+        """
+        prefix = (
+            self._structured_prompt_prefix if structured else self._text_prompt_prefix
+        )
+        data_block = self._build_data_block(field_values, baseline_text, template_id)
+        return f"{prefix}{data_block}{_USER_PROMPT_SUFFIX}"
 
-4. Ensure natural flow while maintaining factual accuracy
+    def _build_batch_user_prompt(
+        self,
+        items: Sequence[Tuple[Dict[str, Any], str, str]],
+    ) -> str:
+        """Build a single user prompt covering several events."""
+        blocks = "\n\n".join(
+            f"### ITEM {idx}\n{self._build_data_block(field_values, baseline_text, template_id)}"
+            for idx, (field_values, template_id, baseline_text) in enumerate(items)
+        )
+        keys = ", ".join(f'"{idx}": "...narrative..."' for idx in range(len(items)))
+        prompt = f"""Generate a COMPLETE patient safety narrative for EACH of the {len(items)} items below, following the guide conventions exactly. Treat every item independently; never mix data between items.
 
-5. **IMPORTANT - ADD CLINICAL DETAIL:**
-   - For liver events: Include specific AST/ALT values if available in verbatim term
-   - Describe clinical significance (e.g., "representing Grade 3 hepatotoxicity")
-   - Add context about timing relative to treatment
-   - Include any relevant clinical assessments
-   - Make each paragraph substantive (not just 1 sentence)
+{blocks}
 
-6. **TARGET LENGTH:** Aim for 250-400 words total (not 100 words)
+{_TASK_INSTRUCTIONS}
 
 **OUTPUT REQUIREMENTS:**
-- Return ONLY the complete narrative text
-- Use double line breaks between paragraphs
+- Return ONLY a JSON object mapping each item number to its narrative: {{{keys}}}
+- Include every item number exactly once
+- Within each narrative, use double line breaks (\\n\\n) between paragraphs
 - No commentary, explanations, or meta-text
 - No unresolved placeholders like {{field}}
 - Professional regulatory tone throughout
 - Each paragraph should be 2-5 sentences (not just 1 sentence)
 
-Generate the comprehensive narrative now:"""
+Generate the JSON object now:"""
 
         return prompt
 
+    def _build_data_block(
+        self,
+        field_values: Dict[str, Any],
+        baseline_text: str,
+        template_id: str,
+    ) -> str:
+        """Format the template, baseline text and structured data for one event."""
+        # Organize fields by category
+        demographics = self._extract_category(field_values, DEMOGRAPHIC_FIELDS)
+        treatment = self._extract_category(field_values, TREATMENT_FIELDS)
+        event_details = self._extract_category(field_values, EVENT_DETAIL_FIELDS)
+        
+        return f"""**TEMPLATE USED:** {template_id}
+
+**BASELINE NARRATIVE (from simple templates):**
+{baseline_text}
+
+**ALL AVAILABLE STRUCTURED DATA:**
+
+Demographics:
+{self._format_fields(demographics)}
+
+Treatment Information:
+{self._format_fields(treatment)}
+
+Event Details:
+{self._format_fields(event_details)}"""
+
+    @staticmethod
+    def _join_sections(content: Optional[str]) -> str:
+        """Join structured narrative sections into double-spaced paragraphs.
+
+        Content that is not a sections object (e.g. from a model without
+        Structured Outputs support) is returned as plain narrative text.
+        """
+        content = (content or "").strip()
+        try:
+            sections = json.loads(content)
+        except ValueError:
+            return content
+        if not isinstance(sections, dict):
+            return content
+        paragraphs = [str(sections.get(name) or "").strip() for name in NARRATIVE_SECTIONS]
+        return "\n\n".join(paragraph for paragraph in paragraphs if paragraph)
+
     @staticmethod
-    def _extract_category(data: Dict[str, Any], keys: list) -> Dict[str, Any]:
-        """Extract subset of fields for a category."""
-        return {k: v for k, v in data.items() if k in keys and v is not None}
+    def _extract_category(
+        data: Dict[str, Any], keys: Sequence[str]
+    ) -> List[Tuple[str, Any]]:
+        """Extract the available fields of a category in declaration order."""
+        return [(key, data[key]) for key in keys if data.get(key) is not None]
 
     @staticmethod
-    def _format_dict(data: Dict[str, Any]) -> str:
-        """Format dictionary as readable list."""
-        if not data:
+    def _format_fields(items: Sequence[Tuple[str, Any]]) -> str:
+        """Format ``(field, value)`` pairs as a readable list."""
+        if not items:
             return "  (no data available)"
-        lines = [f"  - {k}: {v}" for k, v in sorted(data.items())]
-        return "\n".join(lines)
+        return "\n".join(f"  - {key}: {value}" for key, value in items)
 
     @staticmethod
     def _build_client():
@@ -10,6 +10,7 @@ SRC_DIR = Path(__file__).resolve().parent
 if str(SRC_DIR) not in sys.path:
     sys.path.insert(0, str(SRC_DIR))
 
+import logging
 import sqlite3
 import tempfile
 
@@ -19,6 +20,12 @@ from field_mapper import FieldMapper
 from narrative_generator import NarrativeGenerator
 from document_generator import DocumentGenerator
 
+# The library modules no longer configure logging on import; the app does.
+logging.basicConfig(
+    level=logging.INFO,
+    format="%(asctime)s [%(levelname)s] %(name)s - %(message)s",
+)
+
 BASE_DIR = SRC_DIR.parent
 DB_PATH = BASE_DIR / "data" / "processed" / "narratives.db"
 
@@ -35,42 +42,91 @@ st.caption("Rigel Pharmaceuticals \u2014 Study C-935788-061")
 # ── Helper queries ──────────────────────────────────────
 
 
+@st.cache_resource
+def get_conn() -> sqlite3.Connection:
+    """Open one read-only SQLite connection shared across reruns."""
+    conn = sqlite3.connect(str(DB_PATH), check_same_thread=False)
+    conn.execute("PRAGMA query_only = 1;")
+    conn.execute("PRAGMA cache_size = -20000;")
+    return conn
+
+
 @st.cache_data
 def get_subjects() -> list[str]:
     """Fetch all subject IDs from database."""
-    with sqlite3.connect(str(DB_PATH)) as conn:
-        rows = conn.execute(
-            "SELECT DISTINCT subject_id FROM subjects ORDER BY subject_id"
-        ).fetchall()
+    rows = get_conn().execute(
+        "SELECT DISTINCT subject_id FROM subjects ORDER BY subject_id"
+    ).fetchall()
     return [r[0] for r in rows]
 
 
 @st.cache_data
 def get_events(subject_id: str, sae_only: bool) -> list[dict]:
     """Fetch events for a subject."""
-    with sqlite3.connect(str(DB_PATH)) as conn:
-        if sae_only:
-            rows = conn.execute(
-                """SELECT sequence_number, preferred_term, serious_event
-                   FROM adverse_events
-                   WHERE subject_id = ? AND serious_event = 'Y' AND treatment_emergent = 'Y'
-                   ORDER BY sequence_number""",
-                (subject_id,),
-            ).fetchall()
-        else:
-            rows = conn.execute(
-                """SELECT sequence_number, preferred_term, serious_event
-                   FROM adverse_events
-                   WHERE subject_id = ? AND treatment_emergent = 'Y'
-                   ORDER BY sequence_number""",
-                (subject_id,),
-            ).fetchall()
+    conn = get_conn()
+    if sae_only:
+        rows = conn.execute(
+            """SELECT sequence_number, preferred_term, serious_event
+               FROM adverse_events
+               WHERE subject_id = ? AND serious_event = 'Y' AND treatment_emergent = 'Y'
+               ORDER BY sequence_number""",
+            (subject_id,),
+        ).fetchall()
+    else:
+        rows = conn.execute(
+            """SELECT sequence_number, preferred_term, serious_event
+               FROM adverse_events
+               WHERE subject_id = ? AND treatment_emergent = 'Y'
+               ORDER BY sequence_number""",
+            (subject_id,),
+        ).fetchall()
     return [
         {"seq": r[0], "preferred_term": r[1] or "Unknown", "serious": r[2]}
         for r in rows
     ]
 
 
+@st.cache_resource
+def get_mapper() -> FieldMapper:
+    """Build one field mapper on the shared connection."""
+    return FieldMapper(db_path=DB_PATH, connection=get_conn())
+
+
+@st.cache_data(ttl=600)
+def get_subject_data(subject_id: str) -> dict:
+    """Fetch demographics for a subject."""
+    return get_mapper().get_subject_data(subject_id) or {}
+
+
+@st.cache_data(ttl=600)
+def get_treatment_data(subject_id: str) -> dict:
+    """Fetch treatment exposure for a subject."""
+    return get_mapper().get_treatment_data(subject_id) or {}
+
+
+@st.cache_data(ttl=600)
+def get_event_data(subject_id: str, seq_num: int) -> dict:
+    """Fetch a single adverse event."""
+    return get_mapper().get_event_data(subject_id, seq_num) or {}
+
+
+@st.cache_resource
+def get_doc_generator() -> DocumentGenerator:
+    """Build the Word document generator once."""
+    return DocumentGenerator()
+
+
+@st.cache_data
+def build_docx_bytes(narrative: str, subject_id: str, seq_num: int) -> bytes:
+    """Render a narrative to Word once per (narrative, subject, sequence)."""
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        doc_path = Path(tmp_dir) / "narrative.docx"
+        get_doc_generator().create_narrative_document(
+            narrative, subject_id, seq_num, doc_path
+        )
+        return doc_path.read_bytes()
+
+
 # ── Sidebar ─────────────────────────────────────────────
 
 with st.sidebar:
@@ -119,11 +175,9 @@ if subject_id and selected_event:
     seq_num = selected_event["seq"]
 
     # Query source data
-    mapper = FieldMapper(db_path=DB_PATH)
-    subject_data = mapper.get_subject_data(subject_id) or {}
-    treatment_data = mapper.get_treatment_data(subject_id) or {}
-    event_data = mapper.get_event_data(subject_id, seq_num) or {}
-    mapper.close()
+    subject_data = get_subject_data(subject_id)
+    treatment_data = get_treatment_data(subject_id)
+    event_data = get_event_data(subject_id, seq_num)
 
     col_left, col_right = st.columns(2)
 
@@ -182,27 +236,44 @@ if subject_id and selected_event:
     with col_right:
         st.subheader("Generated Narrative")
 
+        streamed = False
         if generate_clicked:
-            with st.spinner("Generating narrative..."):
-                enhancer = None
-                if use_openai:
-                    import os
-
-                    if os.getenv("OPENAI_API_KEY"):
-                        from ai_enhancer import OpenAINarrativeEnhancer
-
-                        enhancer = OpenAINarrativeEnhancer()
-                    else:
-                        st.warning(
-                            "OPENAI_API_KEY not set. Using template-only generation."
-                        )
-
-                gen_mapper = FieldMapper(db_path=DB_PATH)
-                generator = NarrativeGenerator(
-                    field_mapper=gen_mapper, enhancer=enhancer
+            enhancer = None
+            if use_openai:
+                import os
+
+                if os.getenv("OPENAI_API_KEY"):
+                    from ai_enhancer import (
+                        STREAM_INTERRUPTED_MARKER,
+                        OpenAINarrativeEnhancer,
+                    )
+
+                    enhancer = OpenAINarrativeEnhancer(cache_db_path=DB_PATH)
+                else:
+                    st.warning(
+                        "OPENAI_API_KEY not set. Using template-only generation."
+                    )
+
+            generator = NarrativeGenerator(
+                field_mapper=get_mapper(), enhancer=enhancer
+            )
+            if enhancer is not None:
+                # Render OpenAI output as it arrives instead of behind a spinner.
+                narrative_text = st.write_stream(
+                    generator.generate_narrative_stream(subject_id, seq_num)
                 )
-                narrative_text = generator.generate_narrative(subject_id, seq_num)
-                gen_mapper.close()
+                streamed = True
+                if narrative_text.endswith(STREAM_INTERRUPTED_MARKER):
+                    # Never keep (or export) a partial narrative; fall back
+                    # to the non-streaming path, which returns the baseline
+                    # text if OpenAI fails again.
+                    st.warning("OpenAI stream was interrupted; regenerating without streaming.")
+                    with st.spinner("Generating narrative..."):
+                        narrative_text = generator.generate_narrative(subject_id, seq_num)
+                    streamed = False
+            else:
+                with st.spinner("Generating narrative..."):
+                    narrative_text = generator.generate_narrative(subject_id, seq_num)
 
             st.session_state["narrative"] = narrative_text
             st.session_state["narrative_subject"] = subject_id
@@ -211,18 +282,15 @@ if subject_id and selected_event:
         # Display narrative from session state
         narrative = st.session_state.get("narrative")
         if narrative:
-            st.markdown(narrative)
+            if not streamed:
+                st.markdown(narrative)
 
             # Download button
-            doc_gen = DocumentGenerator()
-            with tempfile.NamedTemporaryFile(suffix=".docx", delete=False) as tmp:
-                doc_gen.create_narrative_document(
-                    narrative,
-                    st.session_state["narrative_subject"],
-                    st.session_state["narrative_seq"],
-                    tmp.name,
-                )
-                docx_bytes = Path(tmp.name).read_bytes()
+            docx_bytes = build_docx_bytes(
+                narrative,
+                st.session_state["narrative_subject"],
+                st.session_state["narrative_seq"],
+            )
 
             st.download_button(
                 label="Download as Word",
@@ -3,32 +3,85 @@
 from __future__ import annotations
 
 import argparse
+import importlib.util
 import logging
 import sqlite3
 from contextlib import closing
-from datetime import datetime
 from pathlib import Path
-from typing import Any, Dict, Iterable, List, Optional
+from typing import Any, Dict, Iterable, List, Optional, Tuple
 
+import numpy as np
 import pandas as pd
 
 LOGGER = logging.getLogger(__name__)
-logging.basicConfig(
-    level=logging.INFO,
-    format="%(asctime)s [%(levelname)s] %(name)s - %(message)s",
-)
 
 BASE_DIR = Path(__file__).resolve().parents[1]
 DEFAULT_DB_PATH = BASE_DIR / "data" / "processed" / "narratives.db"
 DEFAULT_EXCEL_PATH = BASE_DIR / "data" / "raw" / "adae.xlsx"
 
 
+BULK_LOAD_PRAGMAS = """
+PRAGMA journal_mode = MEMORY;
+PRAGMA synchronous = OFF;
+PRAGMA temp_store = MEMORY;
+PRAGMA cache_size = -200000;
+"""
+RUNTIME_PRAGMAS = """
+PRAGMA journal_mode = WAL;
+PRAGMA synchronous = NORMAL;
+"""
+
+
 class ADAELoader:
     """Utility class to extract and load ADAE data."""
 
     COL_SUBJECT_ID = "Subject Identifier for the Study"
     COL_UNIQUE_SUBJECT_ID = "Unique Subject Identifier"
 
+    SUBJECT_FIELDS: Tuple[Tuple[str, str, str], ...] = (
+        ("subject_id", COL_UNIQUE_SUBJECT_ID, "string"),
+        ("study_id", "Study Identifier", "string"),
+        ("site_id", "Study Site Identifier", "int"),
+        ("age", "Age", "int"),
+        ("age_units", "Age Units", "string"),
+        ("sex", "Sex", "string"),
+        ("race", "Race", "string"),
+        ("ethnicity", "Ethnicity", "string"),
+    )
+
+    ADVERSE_EVENT_FIELDS: Tuple[Tuple[str, str, str], ...] = (
+        ("subject_id", COL_UNIQUE_SUBJECT_ID, "string"),
+        ("sequence_number", "Sequence Number", "int"),
+        ("sponsor_id", "Sponsor-Defined Identifier", "int"),
+        ("verbatim_term", "Reported Term for the Adverse Event", "string"),
+        ("preferred_term", "Dictionary-Derived Term", "string"),
+        ("pt_code", "Preferred Term Code", "string"),
+        ("soc", "Primary System Organ Class", "string"),
+        ("serious_event", "Serious Event", "string"),
+        ("start_date", "Start Date/Time of Adverse Event", "date"),
+        ("end_date", "End Date/Time of Adverse Event", "date"),
+        ("study_day_start", "Analysis Start Relative Day", "int"),
+        ("study_day_end", "Analysis End Relative Day", "int"),
+        ("severity_grade", "Standard Toxicity Grade", "int"),
+        ("outcome", "Outcome of Adverse Event", "string"),
+        ("action_taken", "Action Taken with Study Treatment", "string"),
+        ("causality", "Causality", "string"),
+        ("analysis_causality", "Analysis Causality", "string"),
+        ("hospitalization", "Requires or Prolongs Hospitalization", "string"),
+        ("life_threatening", "Is Life Threatening", "string"),
+        ("results_in_death", "Results in Death", "string"),
+        ("disability", "Persist or Signif Disability/Incapacity", "string"),
+        ("other_medically_important", "Other Medically Important Serious Event", "string"),
+        ("treatment_emergent", "Treatment Emergent Analysis Flag", "string"),
+    )
+
+    TREATMENT_FIELDS: Tuple[Tuple[str, str, str], ...] = (
+        ("subject_id", COL_UNIQUE_SUBJECT_ID, "string"),
+        ("actual_treatment", "Actual Treatment", "string"),
+        ("first_dose_date", "Date of First Exposure to Treatment", "date"),
+        ("last_dose_date", "Date of Last Exposure to Treatment", "date"),
+    )
+
     def __init__(self, db_path: Path | str = DEFAULT_DB_PATH) -> None:
         self.db_path = Path(db_path)
         self.db_path.parent.mkdir(parents=True, exist_ok=True)
@@ -36,100 +89,87 @@ class ADAELoader:
 
     @staticmethod
     def load_excel(filepath: Path | str) -> pd.DataFrame:
-        """Load ADAE Excel file into a DataFrame."""
+        """Load ADAE Excel file into a DataFrame.
+
+        A sibling ``.parquet`` file (written by ``--to-parquet``) is read
+        instead when it is at least as new as the workbook.
+        """
         filepath = Path(filepath)
-        LOGGER.info("Loading ADAE Excel file from %s", filepath)
-        df = pd.read_excel(filepath)
+        parquet_path = filepath.with_suffix(".parquet")
+        if parquet_path.exists() and (
+            not filepath.exists()
+            or parquet_path.stat().st_mtime >= filepath.stat().st_mtime
+        ):
+            LOGGER.info("Loading ADAE Parquet file from %s", parquet_path)
+            df = pd.read_parquet(parquet_path, dtype_backend=_dtype_backend())
+        else:
+            engine = _excel_engine()
+            LOGGER.info("Loading ADAE Excel file from %s (engine=%s)", filepath, engine)
+            df = pd.read_excel(filepath, engine=engine, dtype_backend=_dtype_backend())
         LOGGER.info("Loaded %d rows from %s", len(df), filepath.name)
         return df
 
+    @classmethod
+    def convert_to_parquet(cls, filepath: Path | str) -> Path:
+        """Write the ADAE workbook to a sibling Parquet file for faster loads."""
+        filepath = Path(filepath)
+        parquet_path = filepath.with_suffix(".parquet")
+        df = pd.read_excel(filepath, engine=_excel_engine())
+        df.to_parquet(parquet_path, compression="zstd")
+        LOGGER.info("Wrote %d rows to %s", len(df), parquet_path)
+        return parquet_path
+
+    FALLBACK_DATE_FORMATS: Tuple[str, ...] = ("%d-%b-%Y", "%d%b%Y", "mixed")
+
+    TABLE_FIELDS: Dict[str, Tuple[Tuple[str, str, str], ...]] = {
+        "subjects": SUBJECT_FIELDS,
+        "adverse_events": ADVERSE_EVENT_FIELDS,
+        "treatment_exposure": TREATMENT_FIELDS,
+    }
+
     def extract_subjects(self, df: pd.DataFrame) -> List[Dict[str, Any]]:
         """Extract unique subjects."""
         subject_rows = df.drop_duplicates(subset=[self.COL_UNIQUE_SUBJECT_ID])
-        subjects: List[Dict[str, Any]] = []
-        for _, row in subject_rows.iterrows():
-            subject = {
-                "subject_id": self._clean_string(row.get(self.COL_UNIQUE_SUBJECT_ID)),
-                "study_id": self._clean_string(row.get("Study Identifier")),
-                "site_id": self._safe_int(row.get("Study Site Identifier")),
-                "age": self._safe_int(row.get("Age")),
-                "age_units": self._clean_string(row.get("Age Units")),
-                "sex": self._clean_string(row.get("Sex")),
-                "race": self._clean_string(row.get("Race")),
-                "ethnicity": self._clean_string(row.get("Ethnicity")),
-            }
-            subjects.append(subject)
+        subjects = self._clean_fields(subject_rows, self.SUBJECT_FIELDS).to_dict(
+            orient="records"
+        )
         LOGGER.info("Extracted %d unique subjects", len(subjects))
         return subjects
 
     def extract_adverse_events(self, df: pd.DataFrame) -> List[Dict[str, Any]]:
         """Extract adverse events records with comprehensive fields."""
-        events: List[Dict[str, Any]] = []
-        for _, row in df.iterrows():
-            event = {
-                "subject_id": self._clean_string(row.get(self.COL_UNIQUE_SUBJECT_ID)),
-                "sequence_number": self._safe_int(row.get("Sequence Number")),
-                "sponsor_id": self._safe_int(row.get("Sponsor-Defined Identifier")),
-                "verbatim_term": self._clean_string(
-                    row.get("Reported Term for the Adverse Event")
-                ),
-                "preferred_term": self._clean_string(
-                    row.get("Dictionary-Derived Term")
-                ),
-                "pt_code": self._clean_string(row.get("Preferred Term Code")),
-                "soc": self._clean_string(row.get("Primary System Organ Class")),
-                "serious_event": self._clean_string(row.get("Serious Event")),
-                "start_date": self._clean_date(row.get("Start Date/Time of Adverse Event")),
-                "end_date": self._clean_date(row.get("End Date/Time of Adverse Event")),
-                "study_day_start": self._safe_int(row.get("Analysis Start Relative Day")),
-                "study_day_end": self._safe_int(row.get("Analysis End Relative Day")),
-                "severity_grade": self._safe_int(row.get("Standard Toxicity Grade")),
-                "outcome": self._clean_string(row.get("Outcome of Adverse Event")),
-                "action_taken": self._clean_string(
-                    row.get("Action Taken with Study Treatment")
-                ),
-                "causality": self._clean_string(row.get("Causality")),
-                "analysis_causality": self._clean_string(row.get("Analysis Causality")),
-                "hospitalization": self._clean_string(
-                    row.get("Requires or Prolongs Hospitalization")
-                ),
-                "life_threatening": self._clean_string(
-                    row.get("Is Life Threatening")
-                ),
-                "results_in_death": self._clean_string(row.get("Results in Death")),
-                "disability": self._clean_string(
-                    row.get("Persist or Signif Disability/Incapacity")
-                ),
-                "other_medically_important": self._clean_string(
-                    row.get("Other Medically Important Serious Event")
-                ),
-                "treatment_emergent": self._clean_string(
-                    row.get("Treatment Emergent Analysis Flag")
-                ),
-            }
-            events.append(event)
+        events = self._clean_fields(df, self.ADVERSE_EVENT_FIELDS).to_dict(
+            orient="records"
+        )
         LOGGER.info("Extracted %d adverse events", len(events))
         return events
 
     def extract_treatment_exposure(self, df: pd.DataFrame) -> List[Dict[str, Any]]:
         """Extract treatment exposure per subject."""
         treatment_rows = df.drop_duplicates(subset=[self.COL_UNIQUE_SUBJECT_ID])
-        exposures: List[Dict[str, Any]] = []
-        for _, row in treatment_rows.iterrows():
-            exposure = {
-                "subject_id": self._clean_string(row.get(self.COL_UNIQUE_SUBJECT_ID)),
-                "actual_treatment": self._clean_string(row.get("Actual Treatment")),
-                "first_dose_date": self._clean_date(
-                    row.get("Date of First Exposure to Treatment")
-                ),
-                "last_dose_date": self._clean_date(
-                    row.get("Date of Last Exposure to Treatment")
-                ),
-            }
-            exposures.append(exposure)
+        exposures = self._clean_fields(treatment_rows, self.TREATMENT_FIELDS).to_dict(
+            orient="records"
+        )
         LOGGER.info("Extracted %d treatment exposure records", len(exposures))
         return exposures
 
+    def extract_tables(self, df: pd.DataFrame) -> Dict[str, pd.DataFrame]:
+        """Clean every source column once and slice it into per-table frames."""
+        fields = {
+            field[0]: field
+            for table_fields in self.TABLE_FIELDS.values()
+            for field in table_fields
+        }
+        cleaned = self._clean_fields(df, fields.values())
+        first_per_subject = ~df[self.COL_UNIQUE_SUBJECT_ID].duplicated()
+        tables: Dict[str, pd.DataFrame] = {}
+        for table, table_fields in self.TABLE_FIELDS.items():
+            columns = [target for target, _, _ in table_fields]
+            rows = cleaned if table == "adverse_events" else cleaned[first_per_subject]
+            tables[table] = rows[columns]
+            LOGGER.info("Extracted %d %s records", len(rows), table)
+        return tables
+
     def load_to_database(
         self, db_path: Optional[Path | str] = None, excel_path: Optional[Path | str] = None
     ) -> Dict[str, int]:
@@ -137,71 +177,33 @@ class ADAELoader:
         db_path = Path(db_path) if db_path else self.db_path
         excel_path = Path(excel_path) if excel_path else DEFAULT_EXCEL_PATH
         df = self.load_excel(excel_path)
-        subjects = self.extract_subjects(df)
-        events = self.extract_adverse_events(df)
-        exposures = self.extract_treatment_exposure(df)
+        tables = self.extract_tables(df)
 
         counts = {"subjects": 0, "adverse_events": 0, "treatment_exposure": 0}
 
         try:
             with closing(sqlite3.connect(db_path)) as conn:
-                conn.execute("PRAGMA foreign_keys = ON;")
+                # The load is idempotent and the Excel file is the source of
+                # truth, so skip fsyncs while inserting and restore afterwards.
+                # Foreign keys stay off (the SQLite default) to avoid a parent
+                # probe per row; integrity is checked once before commit.
+                conn.executescript(BULK_LOAD_PRAGMAS)
                 with conn:
-                    counts["subjects"] = self._insert_records(
-                        conn,
-                        "subjects",
-                        (
-                            "subject_id",
-                            "study_id",
-                            "site_id",
-                            "age",
-                            "age_units",
-                            "sex",
-                            "race",
-                            "ethnicity",
-                        ),
-                        subjects,
-                    )
-                    counts["adverse_events"] = self._insert_records(
-                        conn,
-                        "adverse_events",
-                        (
-                            "subject_id",
-                            "sequence_number",
-                            "sponsor_id",
-                            "verbatim_term",
-                            "preferred_term",
-                            "pt_code",
-                            "soc",
-                            "serious_event",
-                            "start_date",
-                            "end_date",
-                            "study_day_start",
-                            "study_day_end",
-                            "severity_grade",
-                            "outcome",
-                            "action_taken",
-                            "causality",
-                            "hospitalization",
-                            "life_threatening",
-                            "results_in_death",
-                            "disability",
-                            "other_medically_important",
-                            "treatment_emergent",
-                        ),
-                        events,
-                    )
-                    counts["treatment_exposure"] = self._insert_records(
-                        conn,
-                        "treatment_exposure",
-                        (
-                            "subject_id",
-                            "actual_treatment",
-                            "first_dose_date",
-                            "last_dose_date",
-                        ),
-                        exposures,
-                    )
+                    for table, frame in tables.items():
+                        counts[table] = self._insert_records(conn, table, frame)
+                    # Only the reloaded tables need checking, not the whole file.
+                    violations = [
+                        row
+                        for table in tables
+                        for row in conn.execute(f"PRAGMA foreign_key_check({table});")
+                    ]
+                    if violations:
+                        raise sqlite3.IntegrityError(
+                            f"{len(violations)} foreign key violations, first: {violations[0]}"
+                        )
+                conn.executescript(RUNTIME_PRAGMAS)
+                # Refresh planner statistics so the event indexes get used.
+                conn.execute("ANALYZE;")
             LOGGER.info("Data loaded successfully: %s", counts)
             return counts
         except sqlite3.Error as exc:
@@ -212,51 +214,92 @@ class ADAELoader:
     def _insert_records(
         conn: sqlite3.Connection,
         table: str,
-        columns: Iterable[str],
-        records: List[Dict[str, Any]],
+        frame: pd.DataFrame,
     ) -> int:
+        columns = list(frame.columns)
         placeholders = ", ".join(["?"] * len(columns))
         column_list = ", ".join(columns)
         sql = f"INSERT OR REPLACE INTO {table} ({column_list}) VALUES ({placeholders})"
-        rows = [
-            tuple(record.get(column) for column in columns)
-            for record in records
-        ]
-        LOGGER.debug("Inserting %d rows into %s", len(rows), table)
-        conn.executemany(sql, rows)
-        return len(rows)
+        LOGGER.debug("Inserting %d rows into %s", len(frame), table)
+        # itertuples yields plain tuples lazily, so no row list is materialized.
+        conn.executemany(sql, frame.itertuples(index=False, name=None))
+        return len(frame)
+
+    @classmethod
+    def _clean_fields(
+        cls, df: pd.DataFrame, fields: Iterable[Tuple[str, str, str]]
+    ) -> pd.DataFrame:
+        """Clean the configured source columns column-wise."""
+        cleaners = {
+            "string": cls._clean_strings,
+            "int": cls._safe_ints,
+            "date": cls._clean_dates,
+        }
+        columns: Dict[str, pd.Series] = {}
+        for target, source, kind in fields:
+            if source in df.columns:
+                series = df[source]
+            else:
+                series = pd.Series(None, index=df.index, dtype=object)
+            columns[target] = cleaners[kind](series)
+        return pd.DataFrame(columns, index=df.index)
 
     @staticmethod
-    def _clean_string(value: Any) -> Optional[str]:
-        if pd.isna(value):
-            return None
-        value = str(value).strip()
-        return value or None
+    def _clean_strings(series: pd.Series) -> pd.Series:
+        # Arrow-backed string columns strip in place; others convert once.
+        text = series if _is_string_column(series) else series.astype("string")
+        text = text.str.strip()
+        return text.astype(object).where(text.notna() & text.ne(""), None)
 
     @staticmethod
-    def _safe_int(value: Any) -> Optional[int]:
-        if pd.isna(value):
-            return None
-        try:
-            return int(float(value))
-        except (ValueError, TypeError):
-            return None
+    def _safe_ints(series: pd.Series) -> pd.Series:
+        numeric = pd.to_numeric(series, errors="coerce").to_numpy(
+            dtype="float64", na_value=np.nan
+        )
+        numeric = np.where(np.isfinite(numeric), np.trunc(numeric), np.nan)
+        values = pd.Series(numeric, index=series.index).astype("Int64")
+        return values.astype(object).where(values.notna(), None)
 
     @staticmethod
-    def _clean_date(value: Any) -> Optional[str]:
-        if value is None or pd.isna(value):
-            return None
-        if isinstance(value, pd.Timestamp):
-            return value.strftime("%Y-%m-%d")
-        if isinstance(value, datetime):
-            return value.strftime("%Y-%m-%d")
-        try:
-            parsed = pd.to_datetime(value, errors="coerce")
-            if pd.isna(parsed):
-                return None
-            return parsed.strftime("%Y-%m-%d")
-        except (ValueError, TypeError):
-            return None
+    def _clean_dates(series: pd.Series) -> pd.Series:
+        if pd.api.types.is_datetime64_any_dtype(series):
+            parsed = series
+        else:
+            # Known formats first; per-value inference only for leftovers.
+            parsed = pd.to_datetime(series, errors="coerce", format="ISO8601", cache=True)
+            for date_format in ADAELoader.FALLBACK_DATE_FORMATS:
+                remaining = parsed.isna() & series.notna()
+                if not remaining.any():
+                    break
+                parsed = parsed.combine_first(
+                    pd.to_datetime(
+                        series[remaining], errors="coerce", format=date_format, cache=True
+                    )
+                )
+        formatted = parsed.dt.strftime("%Y-%m-%d")
+        return formatted.astype(object).where(formatted.notna(), None)
+
+
+def _is_string_column(series: pd.Series) -> bool:
+    """True for pandas/Arrow string dtypes (not generic object columns)."""
+    dtype = series.dtype
+    if isinstance(dtype, pd.StringDtype):
+        return True
+    return isinstance(dtype, pd.ArrowDtype) and dtype.kind in "OSU"
+
+
+def _dtype_backend() -> str:
+    """Use Arrow-backed columns when pyarrow is installed."""
+    if importlib.util.find_spec("pyarrow") is not None:
+        return "pyarrow"
+    return "numpy_nullable"
+
+
+def _excel_engine() -> str:
+    """Prefer the Rust-based calamine reader, falling back to openpyxl."""
+    if importlib.util.find_spec("python_calamine") is not None:
+        return "calamine"
+    return "openpyxl"
 
 
 def _parse_args() -> argparse.Namespace:
@@ -273,11 +316,23 @@ def _parse_args() -> argparse.Namespace:
         default=DEFAULT_DB_PATH,
         help="Path to SQLite database.",
     )
+    parser.add_argument(
+        "--to-parquet",
+        action="store_true",
+        help="Convert the ADAE Excel file to a sibling Parquet file and exit.",
+    )
     return parser.parse_args()
 
 
 def main() -> None:
+    logging.basicConfig(
+        level=logging.INFO,
+        format="%(asctime)s [%(levelname)s] %(name)s - %(message)s",
+    )
     args = _parse_args()
+    if args.to_parquet:
+        ADAELoader.convert_to_parquet(args.excel)
+        return
     loader = ADAELoader(db_path=args.db_path)
     counts = loader.load_to_database(db_path=args.db_path, excel_path=args.excel)
     LOGGER.info(
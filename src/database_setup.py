@@ -4,20 +4,24 @@ from __future__ import annotations
 
 import argparse
 import logging
+import os
 import sqlite3
 from contextlib import closing
 from pathlib import Path
 from typing import Iterable
 
-logging.basicConfig(
-    level=logging.INFO,
-    format="%(asctime)s [%(levelname)s] %(name)s - %(message)s",
-)
 LOGGER = logging.getLogger(__name__)
 
 BASE_DIR = Path(__file__).resolve().parents[1]
 DB_PATH = BASE_DIR / "data" / "processed" / "narratives.db"
 
+NARRATIVE_CACHE_TABLE_STATEMENT = """
+    CREATE TABLE IF NOT EXISTS narrative_cache (
+        hash TEXT PRIMARY KEY,
+        narrative TEXT
+    );
+    """
+
 CREATE_TABLE_STATEMENTS: Iterable[str] = (
     """
     CREATE TABLE IF NOT EXISTS subjects (
@@ -82,9 +86,29 @@ CREATE_TABLE_STATEMENTS: Iterable[str] = (
             REFERENCES adverse_events(subject_id, sequence_number)
     );
     """,
+    NARRATIVE_CACHE_TABLE_STATEMENT,
+)
+
+CREATE_INDEX_STATEMENTS: Iterable[str] = (
+    # Covers the per-subject event lookup (filter, sort and selected columns).
+    """
+    CREATE INDEX IF NOT EXISTS idx_ae_subj_tese
+        ON adverse_events (
+            subject_id, treatment_emergent, serious_event, sequence_number, preferred_term
+        );
+    """,
+    # Covers the batch SAE/TEAE scans in main._fetch_sae_events, already in
+    # (subject_id, sequence_number) order.
+    """
+    CREATE INDEX IF NOT EXISTS idx_ae_te_serious
+        ON adverse_events (
+            treatment_emergent, serious_event, subject_id, sequence_number
+        );
+    """,
 )
 
 TABLE_NAMES = (
+    "narrative_cache",
     "narratives",
     "treatment_exposure",
     "adverse_events",
@@ -92,20 +116,49 @@ TABLE_NAMES = (
 )
 
 
+# The whole schema as one script, so executescript parses it in a single pass.
+_SCHEMA_SQL = "\n".join((*CREATE_TABLE_STATEMENTS, *CREATE_INDEX_STATEMENTS))
+_DROP_SQL = "\n".join(f"DROP TABLE IF EXISTS {table};" for table in TABLE_NAMES)
+
+READ_PRAGMAS = (
+    "PRAGMA temp_store = MEMORY;",
+    "PRAGMA cache_size = -64000;",
+    "PRAGMA mmap_size = 268435456;",
+)
+PERFORMANCE_PRAGMAS = (
+    "PRAGMA journal_mode = WAL;",
+    "PRAGMA synchronous = NORMAL;",
+    *READ_PRAGMAS,
+)
+# Dev-only: skip fsyncs entirely. A crash may corrupt the database file.
+UNSAFE_WRITES_ENV = "NARRATIVE_DB_UNSAFE_WRITES"
+
+
+def apply_pragmas(connection: sqlite3.Connection, read_only: bool = False) -> None:
+    """Switch a connection to WAL journaling and in-memory temp storage.
+
+    ``read_only`` connections only get the cache settings, since they cannot
+    change the journal mode.
+    """
+    for pragma in READ_PRAGMAS if read_only else PERFORMANCE_PRAGMAS:
+        connection.execute(pragma)
+    if not read_only and os.getenv(UNSAFE_WRITES_ENV) == "1":
+        connection.execute("PRAGMA synchronous = OFF;")
+
+
 def _connect(db_path: Path = DB_PATH) -> sqlite3.Connection:
     db_path.parent.mkdir(parents=True, exist_ok=True)
     connection = sqlite3.connect(db_path)
     connection.execute("PRAGMA foreign_keys = ON;")
+    apply_pragmas(connection)
     return connection
 
 
 def create_tables(db_path: Path = DB_PATH) -> None:
     """Create all database tables."""
     try:
-        with closing(_connect(db_path)) as conn, conn:
-            for statement in CREATE_TABLE_STATEMENTS:
-                LOGGER.debug("Executing SQL: %s", statement.strip().splitlines()[0])
-                conn.execute(statement)
+        with closing(_connect(db_path)) as conn:
+            conn.executescript(f"BEGIN;\n{_SCHEMA_SQL}\nCOMMIT;")
         LOGGER.info("Tables created successfully at %s", db_path)
     except sqlite3.Error as exc:
         LOGGER.exception("Failed to create tables: %s", exc)
@@ -115,12 +168,9 @@ def create_tables(db_path: Path = DB_PATH) -> None:
 def reset_database(db_path: Path = DB_PATH) -> None:
     """Drop all tables then recreate schema."""
     try:
-        with closing(_connect(db_path)) as conn, conn:
-            for table in TABLE_NAMES:
-                LOGGER.debug("Dropping table if exists: %s", table)
-                conn.execute(f"DROP TABLE IF EXISTS {table};")
-        LOGGER.info("Existing tables dropped.")
-        create_tables(db_path)
+        with closing(_connect(db_path)) as conn:
+            conn.executescript(f"BEGIN;\n{_DROP_SQL}\n{_SCHEMA_SQL}\nCOMMIT;")
+        LOGGER.info("Tables dropped and recreated at %s", db_path)
     except sqlite3.Error as exc:
         LOGGER.exception("Failed to reset database: %s", exc)
         raise
@@ -143,6 +193,10 @@ def _parse_args() -> argparse.Namespace:
 
 
 def main() -> None:
+    logging.basicConfig(
+        level=logging.INFO,
+        format="%(asctime)s [%(levelname)s] %(name)s - %(message)s",
+    )
     args = _parse_args()
     db_path = args.db_path
     if args.reset:
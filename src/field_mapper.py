@@ -5,21 +5,41 @@ from __future__ import annotations
 import argparse
 import json
 import logging
+import os
+import pickle
 import sqlite3
+import tempfile
 from datetime import datetime
 from pathlib import Path
-from typing import Any, Dict, Optional
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Tuple
+
+import pandas as pd
+
+from database_setup import apply_pragmas
 
 LOGGER = logging.getLogger(__name__)
-logging.basicConfig(
-    level=logging.INFO,
-    format="%(asctime)s [%(levelname)s] %(name)s - %(message)s",
-)
 
 BASE_DIR = Path(__file__).resolve().parents[1]
 DEFAULT_DB_PATH = BASE_DIR / "data" / "processed" / "narratives.db"
 DEFAULT_CONFIG_PATH = BASE_DIR / "configs" / "field_mappings.json"
 
+_MONTH_ABBRS = (
+    "", "Jan", "Feb", "Mar", "Apr", "May", "Jun",
+    "Jul", "Aug", "Sep", "Oct", "Nov", "Dec",
+)
+_MONTHS = {abbr.upper(): number for number, abbr in enumerate(_MONTH_ABBRS) if abbr}
+
+# Single-line lookups, kept as constants so sqlite3's statement cache reuses them.
+_SQL_GET_SUBJECT = "SELECT * FROM subjects WHERE subject_id = ?"
+_SQL_GET_TREATMENT = "SELECT * FROM treatment_exposure WHERE subject_id = ?"
+_SQL_GET_EVENT = "SELECT * FROM adverse_events WHERE subject_id = ? AND sequence_number = ?"
+
+# Rows per bulk query, kept below SQLite's bound-parameter limit.
+BULK_CHUNK_SIZE = 400
+
+# (name, db_table, db_column, value_map or None, is_date)
+FieldPlan = List[Tuple[str, str, str, Optional[Dict[str, Any]], bool]]
+
 
 class FieldMapper:
     """Lookup and transform subject, treatment, and event fields."""
@@ -28,47 +48,231 @@ class FieldMapper:
         self,
         config_path: Path | str = DEFAULT_CONFIG_PATH,
         db_path: Path | str = DEFAULT_DB_PATH,
+        connection: Optional[sqlite3.Connection] = None,
     ) -> None:
         self.config_path = Path(config_path)
         self.db_path = Path(db_path)
-        self.config = self._load_config(self.config_path)
-        self.connection = sqlite3.connect(self.db_path)
+        self.config, self._field_plan = self._load_cached_plan(self.config_path)
+        # A caller-supplied connection is borrowed and left open by close().
+        self._owns_connection = connection is None
+        if connection is None:
+            connection = sqlite3.connect(self.db_path, cached_statements=256)
+            apply_pragmas(connection)
+        self.connection = connection
         self.connection.row_factory = sqlite3.Row
+        # Filled by bulk_load(); lookups fall back to SQL on a miss.
+        self._subject_cache: Dict[str, sqlite3.Row] = {}
+        self._treatment_cache: Dict[str, sqlite3.Row] = {}
+        self._event_cache: Dict[Tuple[str, int], sqlite3.Row] = {}
+        # Event row read by the latest map_all_fields(), reused once by the
+        # event lookup made for the same narrative (template selection).
+        self._last_event: Optional[Tuple[Tuple[str, int], sqlite3.Row]] = None
         LOGGER.debug(
             "FieldMapper initialized with config=%s, db=%s",
             self.config_path,
             self.db_path,
         )
 
+    @classmethod
+    def readonly(
+        cls,
+        db_path: Path | str = DEFAULT_DB_PATH,
+        config_path: Path | str = DEFAULT_CONFIG_PATH,
+    ) -> "FieldMapper":
+        """Build a mapper on its own read-only connection, usable from any thread.
+
+        Under WAL, read-only readers never block the writer saving narratives.
+        """
+        uri = f"{Path(db_path).resolve().as_uri()}?mode=ro"
+        connection = sqlite3.connect(
+            uri, uri=True, check_same_thread=False, cached_statements=256
+        )
+        apply_pragmas(connection, read_only=True)
+        mapper = cls(config_path=config_path, db_path=db_path, connection=connection)
+        mapper._owns_connection = True
+        return mapper
+
+    @classmethod
+    def _load_cached_plan(cls, path: Path) -> Tuple[Dict[str, Any], FieldPlan]:
+        """Load config and field plan, reusing a pickled copy while the JSON is unchanged."""
+        cache_path = path.with_suffix(".plan.pkl")
+        stat = path.stat()
+        stamp = (stat.st_mtime_ns, stat.st_size)
+        try:
+            with cache_path.open("rb") as handle:
+                cached = pickle.load(handle)
+            if cached["stamp"] == stamp:
+                return cached["config"], cached["plan"]
+        except Exception:
+            # Missing, corrupt or from an older FieldPlan layout: rebuild it.
+            pass
+        config = cls._load_config(path)
+        plan = cls._compile_field_plan(config)
+        try:
+            # Write beside the target and rename, so a concurrent reader never
+            # sees a half-written pickle.
+            with tempfile.NamedTemporaryFile(
+                "wb", dir=cache_path.parent, prefix=f"{cache_path.name}.", delete=False
+            ) as handle:
+                pickle.dump({"stamp": stamp, "config": config, "plan": plan}, handle)
+            try:
+                os.replace(handle.name, cache_path)
+            except OSError:
+                os.unlink(handle.name)
+                raise
+        except OSError as exc:
+            LOGGER.debug("Could not write field plan cache %s: %s", cache_path, exc)
+        return config, plan
+
     @staticmethod
     def _load_config(path: Path) -> Dict[str, Any]:
         with path.open("r", encoding="utf-8") as handle:
             config = json.load(handle)
+        # Upper-case value_map keys once so lookups need a single probe.
+        for section in config.values():
+            for field in section.get("fields", []):
+                if field.get("value_map"):
+                    field["value_map"] = {
+                        str(key).upper(): mapped for key, mapped in field["value_map"].items()
+                    }
         return config
 
+    @staticmethod
+    def _compile_field_plan(config: Dict[str, Any]) -> FieldPlan:
+        """Flatten the sectioned config into one entry per mapped field."""
+        return [
+            (
+                field["name"],
+                field["db_table"],
+                field["db_column"],
+                field.get("value_map") or None,
+                field.get("format") == "date",
+            )
+            for section in config.values()
+            for field in section.get("fields", [])
+        ]
+
+    def bulk_load(self, events: Sequence[Tuple[str, int]]) -> None:
+        """Prefetch subject, treatment and event rows for many events at once."""
+        subject_ids = list(dict.fromkeys(subject_id for subject_id, _ in events))
+        for start in range(0, len(subject_ids), BULK_CHUNK_SIZE):
+            chunk = subject_ids[start : start + BULK_CHUNK_SIZE]
+            marks = ", ".join("?" * len(chunk))
+            for row in self._fetch_all(
+                f"SELECT * FROM subjects WHERE subject_id IN ({marks})", chunk
+            ):
+                self._subject_cache[row["subject_id"]] = row
+            for row in self._fetch_all(
+                f"SELECT * FROM treatment_exposure WHERE subject_id IN ({marks})", chunk
+            ):
+                self._treatment_cache[row["subject_id"]] = row
+        for start in range(0, len(events), BULK_CHUNK_SIZE):
+            chunk = events[start : start + BULK_CHUNK_SIZE]
+            marks = ", ".join("(?, ?)" for _ in chunk)
+            params = [value for event in chunk for value in event]
+            for row in self._fetch_all(
+                f"""
+                SELECT * FROM adverse_events
+                WHERE (subject_id, sequence_number) IN (VALUES {marks})
+                """,
+                params,
+            ):
+                self._event_cache[(row["subject_id"], row["sequence_number"])] = row
+        LOGGER.info(
+            "Prefetched %d subjects, %d treatments and %d events",
+            len(self._subject_cache),
+            len(self._treatment_cache),
+            len(self._event_cache),
+        )
+
+    def batch_map(self, events: Sequence[Tuple[str, int]]) -> pd.DataFrame:
+        """Map fields for many events column-wise; one row per event, in order.
+
+        Produces the same values as calling ``map_all_fields`` per event, but
+        value maps are applied to whole columns at once and each distinct
+        date value is parsed and formatted only once.
+        """
+        self.bulk_load(events)
+        frames = {
+            "subjects": _rows_frame(self._subject_row(s) for s, _ in events),
+            "adverse_events": _rows_frame(self._event_row(s, q) for s, q in events),
+            "treatment_exposure": _rows_frame(self._treatment_row(s) for s, _ in events),
+        }
+        missing = pd.Series([None] * len(events), dtype=object)
+        columns: Dict[str, pd.Series] = {}
+        for name, table, column, value_map, is_date in self._field_plan:
+            frame = frames.get(table)
+            values = frame[column] if frame is not None and column in frame else missing
+            if value_map:
+                present = values[values.notna()]
+                mapped = present.astype(str).str.upper().map(value_map)
+                values = mapped.reindex(values.index).fillna(values)
+            if is_date:
+                # Same parser and English month names as map_all_fields; not
+                # pd.to_datetime/strftime, which drop years outside pandas'
+                # range and follow the process locale.
+                formatted = {raw: _date_or_raw(raw) for raw in values.dropna().unique()}
+                values = values.map(formatted).where(values.notna(), values)
+            columns[name] = values
+        result = pd.DataFrame(columns, dtype=object)
+        return result.where(result.notna(), None)
+
+    def map_all_fields_batch(
+        self, events: Sequence[Tuple[str, int]]
+    ) -> Dict[Tuple[str, int], Dict[str, Any]]:
+        """Map fields for many events, keyed by ``(subject_id, sequence_number)``."""
+        self.bulk_load(events)
+        return {
+            (subject_id, seq): self.map_all_fields(subject_id, seq)
+            for subject_id, seq in events
+        }
+
     def get_subject_data(self, subject_id: str) -> Optional[Dict[str, Any]]:
+        return _as_dict(self._subject_row(subject_id))
+
+    def get_treatment_data(self, subject_id: str) -> Optional[Dict[str, Any]]:
+        return _as_dict(self._treatment_row(subject_id))
+
+    def get_event_data(
+        self, subject_id: str, sequence_number: int
+    ) -> Optional[Dict[str, Any]]:
+        return _as_dict(self._event_row(subject_id, sequence_number))
+
+    def _subject_row(self, subject_id: str) -> Optional[sqlite3.Row]:
+        cached = self._subject_cache.get(subject_id)
+        if cached is not None:
+            return cached
         return self._fetch_one(
-            "SELECT * FROM subjects WHERE subject_id = ?",
+            _SQL_GET_SUBJECT,
             (subject_id,),
             not_found_log=f"Subject {subject_id} not found.",
         )
 
-    def get_treatment_data(self, subject_id: str) -> Optional[Dict[str, Any]]:
+    def _treatment_row(self, subject_id: str) -> Optional[sqlite3.Row]:
+        cached = self._treatment_cache.get(subject_id)
+        if cached is not None:
+            return cached
         return self._fetch_one(
-            "SELECT * FROM treatment_exposure WHERE subject_id = ?",
+            _SQL_GET_TREATMENT,
             (subject_id,),
             not_found_log=f"Treatment exposure for {subject_id} not found.",
         )
 
-    def get_event_data(
+    def _event_row(
         self, subject_id: str, sequence_number: int
-    ) -> Optional[Dict[str, Any]]:
+    ) -> Optional[sqlite3.Row]:
+        key = (subject_id, sequence_number)
+        cached = self._event_cache.get(key)
+        if cached is not None:
+            return cached
+        last_event = self._last_event
+        if last_event is not None and last_event[0] == key:
+            # Handed out once, to the lookup that follows map_all_fields().
+            self._last_event = None
+            return last_event[1]
         return self._fetch_one(
-            """
-            SELECT * FROM adverse_events
-            WHERE subject_id = ? AND sequence_number = ?
-            """,
-            (subject_id, sequence_number),
+            _SQL_GET_EVENT,
+            key,
             not_found_log=(
                 f"Adverse event not found for subject {subject_id} "
                 f"sequence {sequence_number}."
@@ -82,7 +286,7 @@ class FieldMapper:
         value_map = config.get("value_map")
         if value is None or not value_map:
             return value
-        mapped_value = value_map.get(str(value).upper()) or value_map.get(value)
+        mapped_value = value_map.get(_map_key(value))
         if mapped_value is None:
             return value
         LOGGER.debug("Value mapping applied for %s: %s -> %s", field_name, value, mapped_value)
@@ -96,7 +300,7 @@ class FieldMapper:
         if formatter == "date":
             parsed = self._parse_date(value)
             if parsed:
-                formatted = parsed.strftime("%d-%b-%Y")
+                formatted = _format_date(parsed)
                 LOGGER.debug(
                     "Date formatted for %s: %s -> %s", field_name, value, formatted
                 )
@@ -108,51 +312,56 @@ class FieldMapper:
         LOGGER.info(
             "Mapping fields for subject %s sequence %s", subject_id, sequence_number
         )
-        subject_data = self.get_subject_data(subject_id)
-        event_data = self.get_event_data(subject_id, sequence_number)
-        treatment_data = self.get_treatment_data(subject_id)
+        subject_row = self._subject_row(subject_id)
+        event_row = self._event_row(subject_id, sequence_number)
+        treatment_row = self._treatment_row(subject_id)
+        self._last_event = (
+            ((subject_id, sequence_number), event_row) if event_row is not None else None
+        )
 
+        # Rows are read by column name directly; no per-row dict is built.
         data_sources = {
-            "subjects": subject_data or {},
-            "adverse_events": event_data or {},
-            "treatment_exposure": treatment_data or {},
+            "subjects": subject_row,
+            "adverse_events": event_row,
+            "treatment_exposure": treatment_row,
         }
 
-        if not subject_data:
+        if subject_row is None:
             LOGGER.warning("Subject data missing for %s", subject_id)
-        if not event_data:
+        if event_row is None:
             LOGGER.warning("Event data missing for %s seq %s", subject_id, sequence_number)
-        if not treatment_data:
+        if treatment_row is None:
             LOGGER.warning("Treatment data missing for %s", subject_id)
 
+        debug = LOGGER.isEnabledFor(logging.DEBUG)
         mapped_fields: Dict[str, Any] = {}
-        for section_name, section in self.config.items():
-            for field in section.get("fields", []):
-                table = field["db_table"]
-                column = field["db_column"]
-                raw_value = data_sources.get(table, {}).get(column)
-                value = self.apply_value_mapping(field["name"], raw_value, field)
-                value = self.format_field(field["name"], value, field)
-                mapped_fields[field["name"]] = value
-                LOGGER.debug(
-                    "Mapped %s.%s (%s) -> %s",
-                    table,
-                    column,
-                    field["name"],
-                    value,
-                )
+        for name, table, column, value_map, is_date in self._field_plan:
+            value = _column(data_sources.get(table), column)
+            if value is not None:
+                if value_map:
+                    mapped_value = value_map.get(_map_key(value))
+                    if mapped_value is not None:
+                        value = mapped_value
+                if is_date:
+                    parsed = self._parse_date(value)
+                    if parsed:
+                        value = _format_date(parsed)
+            mapped_fields[name] = value
+            if debug:
+                LOGGER.debug("Mapped %s.%s (%s) -> %s", table, column, name, value)
         return mapped_fields
 
     def close(self) -> None:
-        """Close the database connection."""
-        self.connection.close()
+        """Close the database connection if this mapper opened it."""
+        if self._owns_connection:
+            self.connection.close()
 
     def _fetch_one(
         self,
         query: str,
         params: tuple[Any, ...],
         not_found_log: Optional[str] = None,
-    ) -> Optional[Dict[str, Any]]:
+    ) -> Optional[sqlite3.Row]:
         try:
             cursor = self.connection.execute(query, params)
             row = cursor.fetchone()
@@ -163,12 +372,34 @@ class FieldMapper:
             if not_found_log:
                 LOGGER.warning(not_found_log)
             return None
-        return dict(row)
+        return row
+
+    def _fetch_all(
+        self, query: str, params: Sequence[Any]
+    ) -> List[sqlite3.Row]:
+        try:
+            return self.connection.execute(query, params).fetchall()
+        except sqlite3.Error as exc:
+            LOGGER.exception("Database query failed: %s", exc)
+            raise
 
     @staticmethod
     def _parse_date(value: Any) -> Optional[datetime]:
         if isinstance(value, datetime):
             return value
+        if isinstance(value, str):
+            # Fast paths for YYYY-MM-DD and DD-Mon-YYYY; anything else falls
+            # through to strptime.
+            try:
+                if len(value) == 10 and value[4] == "-" and value[7] == "-":
+                    if value[:4].isdigit() and value[5:7].isdigit() and value[8:].isdigit():
+                        return datetime(int(value[:4]), int(value[5:7]), int(value[8:]))
+                elif len(value) == 11 and value[2] == "-" and value[6] == "-":
+                    month = _MONTHS.get(value[3:6].upper())
+                    if month and value[:2].isdigit() and value[7:].isdigit():
+                        return datetime(int(value[7:]), month, int(value[:2]))
+            except ValueError:
+                return None
         try:
             parsed = datetime.strptime(value, "%Y-%m-%d")
             return parsed
@@ -180,6 +411,41 @@ class FieldMapper:
                 return None
 
 
+def _map_key(value: Any) -> str:
+    """Normalize a raw value to the upper-cased value_map key space."""
+    return value.upper() if isinstance(value, str) else str(value).upper()
+
+
+def _format_date(value: datetime) -> str:
+    """Format as DD-Mon-YYYY without going through strftime."""
+    return f"{value.day:02d}-{_MONTH_ABBRS[value.month]}-{value.year}"
+
+
+def _date_or_raw(value: Any) -> Any:
+    parsed = FieldMapper._parse_date(value)
+    return _format_date(parsed) if parsed else value
+
+
+def _rows_frame(rows: Iterable[Optional[sqlite3.Row]]) -> pd.DataFrame:
+    """Build an object-dtype frame from rows, with an empty row for misses."""
+    return pd.DataFrame(
+        [dict(row) if row is not None else {} for row in rows], dtype=object
+    )
+
+
+def _as_dict(row: Optional[sqlite3.Row]) -> Optional[Dict[str, Any]]:
+    return dict(row) if row is not None else None
+
+
+def _column(row: Optional[sqlite3.Row], column: str) -> Any:
+    if row is None:
+        return None
+    try:
+        return row[column]
+    except IndexError:
+        return None
+
+
 def _parse_args() -> argparse.Namespace:
     parser = argparse.ArgumentParser(description="Test FieldMapper mappings.")
     parser.add_argument("--subject", required=True, help="Subject identifier.")
@@ -205,6 +471,10 @@ def _parse_args() -> argparse.Namespace:
 
 
 def main() -> None:
+    logging.basicConfig(
+        level=logging.INFO,
+        format="%(asctime)s [%(levelname)s] %(name)s - %(message)s",
+    )
     args = _parse_args()
     mapper = FieldMapper(config_path=args.config, db_path=args.db_path)
     try:
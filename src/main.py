@@ -4,12 +4,14 @@ from __future__ import annotations
 
 import argparse
 import logging
+import os
 import sqlite3
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import closing
 from datetime import datetime
 from pathlib import Path
-from typing import Dict, List, Tuple
+from typing import TYPE_CHECKING, Dict, List, Tuple
 
-from ai_enhancer import OpenAINarrativeEnhancer
 from data_loader import (
     ADAELoader,
     DEFAULT_DB_PATH as LOADER_DB_PATH,
@@ -20,10 +22,9 @@ from document_generator import DocumentGenerator
 from field_mapper import FieldMapper, DEFAULT_DB_PATH as MAPPER_DB_PATH
 from narrative_generator import NarrativeGenerator
 
-logging.basicConfig(
-    level=logging.INFO,
-    format="%(asctime)s [%(levelname)s] %(name)s - %(message)s",
-)
+if TYPE_CHECKING:  # only needed at runtime when --use-openai is set
+    from ai_enhancer import OpenAINarrativeEnhancer
+
 LOGGER = logging.getLogger(__name__)
 
 BASE_DIR = Path(__file__).resolve().parents[1]
@@ -64,7 +65,7 @@ def generate_single_narrative(
         sequence_number,
         narrative_text,
         template["template_id"],
-        db_path=db_path,
+        conn=mapper.connection,
     )
     output_dir = Path(output_dir)
     timestamp = datetime.now().strftime("%Y%m%d")
@@ -84,37 +85,27 @@ def generate_all_saes(
     include_non_serious: bool = False,
 ) -> int:
     """Generate narratives for all SAEs (or all AEs if include_non_serious=True)."""
-    mapper = FieldMapper(db_path=db_path)
+    mapper = FieldMapper.readonly(db_path=db_path)
     generator = NarrativeGenerator(field_mapper=mapper, enhancer=enhancer)
     doc_gen = DocumentGenerator()
+    # generate_many prefetches every row once through FieldMapper.batch_map.
     sae_events = _fetch_sae_events(db_path, include_non_serious=include_non_serious)
     narratives_list: List[Dict[str, str | int]] = []
+    narrative_rows: List[Tuple[str, int, str, str]] = []
+    doc_tasks: List[Tuple[str, str, int, Path]] = []
     output_dir = Path(output_dir)
+    # Loop invariants: one date stamp and file-name prefix for the whole batch.
+    timestamp = datetime.now().strftime("%Y%m%d")
+    doc_prefix = f"{timestamp}_narrative_"
+    total = len(sae_events)
 
-    for idx, (subject_id, sequence_number) in enumerate(sae_events, start=1):
-        LOGGER.info(
-            "Generating narrative %d/%d for subject %s seq %s",
-            idx,
-            len(sae_events),
-            subject_id,
-            sequence_number,
-        )
-        narrative = generator.generate_narrative(subject_id, sequence_number)
-        template = generator.select_template(
-            mapper.get_event_data(subject_id, sequence_number) or {}
-        )
-        NarrativeGenerator.save_to_database(
-            subject_id,
-            sequence_number,
-            narrative,
-            template["template_id"],
-            db_path=db_path,
-        )
-        timestamp = datetime.now().strftime("%Y%m%d")
-        doc_path = output_dir / f"{timestamp}_narrative_{subject_id}_{sequence_number}.docx"
-        doc_gen.create_narrative_document(
-            narrative, subject_id, sequence_number, doc_path
-        )
+    LOGGER.info("Generating %d narratives", total)
+    results = generator.generate_many(sae_events)
+    for (subject_id, sequence_number), (narrative, template_id) in zip(
+        sae_events, results
+    ):
+        doc_path = output_dir / f"{doc_prefix}{subject_id}_{sequence_number}.docx"
+        doc_tasks.append((narrative, subject_id, sequence_number, doc_path))
         narratives_list.append(
             {
                 "subject_id": subject_id,
@@ -122,39 +113,46 @@ def generate_all_saes(
                 "narrative_text": narrative,
             }
         )
+        narrative_rows.append((subject_id, sequence_number, narrative, template_id))
+
+    _write_documents(doc_gen, doc_tasks)
+
+    # One transaction for every narrative instead of a commit per row.
+    NarrativeGenerator.save_many(narrative_rows, db_path=db_path)
 
-    timestamp = datetime.now().strftime("%Y%m%d")
     batch_path = output_dir / f"{timestamp}_batch_report.docx"
     doc_gen.create_batch_document(narratives_list, batch_path)
     mapper.close()
-    LOGGER.info("Generated %d SAE narratives.", len(sae_events))
-    return len(sae_events)
+    LOGGER.info("Generated %d SAE narratives.", total)
+    return total
+
+
+def _write_documents(
+    doc_gen: DocumentGenerator, tasks: List[Tuple[str, str, int, Path]]
+) -> None:
+    """Write the per-narrative Word documents concurrently."""
+    if not tasks:
+        return
+    workers = min(len(tasks), os.cpu_count() or 1)
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        # list() re-raises the first failed write.
+        list(executor.map(lambda task: doc_gen.create_narrative_document(*task), tasks))
 
 
 def _fetch_sae_events(db_path: Path | str, include_non_serious: bool = False) -> List[Tuple[str, int]]:
     """Fetch SAE events (or all AEs if include_non_serious=True)."""
-    with sqlite3.connect(db_path) as conn:
-        if include_non_serious:
-            # Get all treatment-emergent AEs (serious and non-serious)
-            rows = conn.execute(
-                """
-                SELECT subject_id, sequence_number
-                FROM adverse_events
-                WHERE treatment_emergent = 'Y'
-                ORDER BY subject_id, sequence_number
-                """
-            ).fetchall()
-        else:
-            # Get only SAEs
-            rows = conn.execute(
-                """
-                SELECT subject_id, sequence_number
-                FROM adverse_events
-                WHERE serious_event = 'Y' AND treatment_emergent = 'Y'
-                ORDER BY subject_id, sequence_number
-                """
-            ).fetchall()
-    return [(row[0], row[1]) for row in rows]
+    # All treatment-emergent AEs, or only the serious ones.
+    serious_filter = "" if include_non_serious else "AND serious_event = 'Y'"
+    with closing(sqlite3.connect(db_path)) as conn:
+        # Rows are already (subject_id, sequence_number) tuples; no copy needed.
+        return conn.execute(
+            f"""
+            SELECT subject_id, sequence_number
+            FROM adverse_events
+            WHERE treatment_emergent = 'Y' {serious_filter}
+            ORDER BY subject_id, sequence_number
+            """
+        ).fetchall()
 
 
 def _parse_args() -> argparse.Namespace:
@@ -193,9 +191,15 @@ def _parse_args() -> argparse.Namespace:
     parser.add_argument(
         "--openai-temperature",
         type=float,
-        default=0.2,
+        default=0.0,
         help="Sampling temperature for OpenAI enhancement.",
     )
+    parser.add_argument(
+        "--openai-seed",
+        type=int,
+        default=42,
+        help="Sampling seed for reproducible OpenAI output.",
+    )
     parser.add_argument(
         "--openai-max-tokens",
         type=int,
@@ -206,6 +210,10 @@ def _parse_args() -> argparse.Namespace:
 
 
 def main() -> None:
+    logging.basicConfig(
+        level=logging.INFO,
+        format="%(asctime)s [%(levelname)s] %(name)s - %(message)s",
+    )
     args = _parse_args()
     enhancer = None
     if args.use_openai:
@@ -213,6 +221,7 @@ def main() -> None:
             model=args.openai_model,
             temperature=args.openai_temperature,
             max_tokens=args.openai_max_tokens,
+            seed=args.openai_seed,
         )
     if args.setup:
         setup_database()
@@ -231,12 +240,17 @@ def _build_openai_enhancer(
     model: str,
     temperature: float,
     max_tokens: int,
+    seed: int | None = None,
 ) -> OpenAINarrativeEnhancer:
+    from ai_enhancer import OpenAINarrativeEnhancer
+
     LOGGER.info("OpenAI enhancement enabled using model %s.", model)
     return OpenAINarrativeEnhancer(
         model=model,
         temperature=temperature,
         max_tokens=max_tokens,
+        seed=seed,
+        cache_db_path=MAPPER_DB_PATH,
     )
 
 
@@ -3,28 +3,188 @@
 from __future__ import annotations
 
 import argparse
+import functools
 import json
 import logging
 import re
 import sqlite3
-from datetime import datetime
+import string
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import closing
+from datetime import datetime, timezone
 from pathlib import Path
-from string import Formatter
-from typing import Any, Dict, List, Optional
+from typing import TYPE_CHECKING, Any, Dict, Iterable, Iterator, List, Optional, Sequence, Tuple
 
+from database_setup import apply_pragmas
 from field_mapper import FieldMapper, DEFAULT_DB_PATH as FM_DB_PATH
-from ai_enhancer import OpenAINarrativeEnhancer
+
+if TYPE_CHECKING:  # imported lazily so template-only runs skip the enhancer module
+    from ai_enhancer import OpenAINarrativeEnhancer
 
 LOGGER = logging.getLogger(__name__)
-logging.basicConfig(
-    level=logging.INFO,
-    format="%(asctime)s [%(levelname)s] %(name)s - %(message)s",
-)
+LOGGER.addHandler(logging.NullHandler())
 
 BASE_DIR = Path(__file__).resolve().parents[1]
 DEFAULT_TEMPLATE_PATH = BASE_DIR / "configs" / "narrative_templates.json"
 
 
+@functools.lru_cache(maxsize=8)
+def _load_templates_cached(path: Path) -> Dict[str, Any]:
+    """Parse the template config once per resolved path; the dict is shared read-only."""
+    with path.open("r", encoding="utf-8") as handle:
+        templates = json.load(handle)
+    # Paragraph order is static, so sort once here rather than per narrative.
+    for template in templates.values():
+        if isinstance(template, dict) and "paragraphs" in template:
+            template["paragraphs"].sort(key=lambda paragraph: paragraph["number"])
+    return templates
+
+
+@functools.lru_cache(maxsize=256)
+def _compile_template(template_text: str) -> Optional[Tuple[str, Tuple[str, ...]]]:
+    """Pre-parse a template into a ``%s`` format string and its field names.
+
+    Returns None when a placeholder uses a conversion, a format spec or an
+    attribute/index lookup; those templates stay on ``str.format_map``.
+    """
+    pieces: List[str] = []
+    fields: List[str] = []
+    for literal, field, spec, conversion in string.Formatter().parse(template_text):
+        pieces.append(literal.replace("%", "%%"))
+        if field is None:
+            continue
+        if spec or conversion or not field.isidentifier():
+            return None
+        pieces.append("%s")
+        fields.append(field)
+    return "".join(pieces), tuple(fields)
+
+
+@functools.lru_cache(maxsize=256)
+def _with_variation(base_template: str, variation_text: str) -> str:
+    # One shared string per combination, so its hash (and compiled form) is
+    # reused instead of building and re-hashing a new text per paragraph.
+    return f"{base_template} {variation_text}"
+
+
+# Field values rendered as "[NOT AVAILABLE]" in templates.
+_MISSING_VALUES = frozenset({None, "", "nan", "NaN"})
+
+_MONTH_ABBRS = ("Jan", "Feb", "Mar", "Apr", "May", "Jun",
+                "Jul", "Aug", "Sep", "Oct", "Nov", "Dec")
+
+
+_DAYS_IN_MONTH = (31, 29, 31, 30, 31, 30, 31, 31, 30, 31, 30, 31)
+
+
+def _iso_date_repl(match: re.Match[str]) -> str:
+    # The regex guarantees the YYYY-MM-DD digit shape, so only the ranges
+    # need checking; invalid calendar dates are left as written.
+    raw = match.group(0)
+    year, month, day = int(raw[:4]), int(raw[5:7]), int(raw[8:10])
+    if (
+        year < 1
+        or not 1 <= month <= 12
+        or not 1 <= day <= _DAYS_IN_MONTH[month - 1]
+        or (month == 2 and day == 29 and not _is_leap_year(year))
+    ):
+        return raw
+    return f"{day:02d}-{_MONTH_ABBRS[month - 1]}-{year}"
+
+
+def _is_leap_year(year: int) -> bool:
+    return year % 4 == 0 and (year % 100 != 0 or year % 400 == 0)
+
+
+_RACE_MAP = {
+    "WHITE": "White",
+    "BLACK OR AFRICAN AMERICAN": "Black or African American",
+    "ASIAN": "Asian",
+    "NOT HISPANIC OR LATINO": "Not Hispanic or Latino",
+    "HISPANIC OR LATINO": "Hispanic or Latino",
+}
+
+_LAST_DOSE_RE = re.compile(r"\blast dose\b", re.IGNORECASE)
+_ISO_DATE_RE = re.compile(r"\b\d{4}-\d{2}-\d{2}\b")
+_AGE_RE = re.compile(r"(\d+)-YEARS-old", re.IGNORECASE)
+
+# All business rules as one alternation, so the narrative is scanned once.
+# Clause rules come first: at the same position they win over "SAE of", as
+# they did when each rule was a separate pass. Race alternatives are
+# longest first so "NOT HISPANIC OR LATINO" wins over its suffix. The leading
+# lookahead rejects positions no rule can start at before any branch is tried.
+_BUSINESS_RULES_RE = re.compile(
+    r"(?=[A-Zal\d])(?:"
+    r"(?P<clause>(?i:action taken with study drug was |assessed the event as ))(?P<tail>[^\.]+)"
+    r"|(?P<last_dose>(?i:\blast dose\b))"
+    r"|(?P<iso_date>\b\d{4}-\d{2}-\d{2}\b)"
+    r"|(?P<age>(?i:\d+-YEARS-old))"
+    r"|\b(?P<race>"
+    + "|".join(map(re.escape, sorted(_RACE_MAP, key=len, reverse=True)))
+    + r")\b"
+    r"|(?<=SAE of )(?P<sae_of>[A-Z])"
+    r")"
+)
+
+
+def _clause_tail(tail: str) -> str:
+    # Rules 1, 2 and 5 ran before/after the clause lowercasing when applied
+    # pass by pass; race and "SAE of" cannot match lowercase text. None of
+    # them depends on case, so the tail is lowercased first and plain
+    # substring checks skip the regex engine when a rule cannot match.
+    tail = tail.lower()
+    if "last dose" in tail:
+        tail = _LAST_DOSE_RE.sub("most recent dose", tail)
+    if "-" in tail:
+        tail = _ISO_DATE_RE.sub(_lower_iso_date_repl, tail)
+    if "-years-old" in tail:
+        tail = _AGE_RE.sub(r"\1-year-old", tail)
+    return tail
+
+
+def _lower_iso_date_repl(match: re.Match[str]) -> str:
+    return _iso_date_repl(match).lower()
+
+
+def _rule7_applies(text: str, pos: int) -> bool:
+    # Run as its own pass, Rule 7 consumed the capital it lowered, so in
+    # "SAE of SAE of X" the second "SAE of " never matched: along a run of
+    # repeats only every other one fires. Count the run ending at pos.
+    repeats = 0
+    while text.endswith("SAE of ", 0, pos - 7 * repeats):
+        repeats += 1
+    return repeats % 2 == 1
+
+
+def _after_sae_of(match: re.Match[str], replacement: str) -> str:
+    # Rule 7 still lowercases a capital that ends up right after "SAE of ".
+    if replacement[:1].isupper() and _rule7_applies(match.string, match.start()):
+        return replacement[0].lower() + replacement[1:]
+    return replacement
+
+
+def _business_rule_repl(match: re.Match[str]) -> str:
+    rule = match.lastgroup
+    if rule == "tail":
+        # Rules 3/4: lowercase action_taken and causality clauses
+        clause = _after_sae_of(match, match.group("clause"))
+        return clause + _clause_tail(match.group("tail"))
+    if rule == "last_dose":
+        # Rule 1: enforce "most recent dose"
+        return "most recent dose"
+    if rule == "iso_date":
+        # Rule 2: normalize ISO dates to DD-MMM-YYYY
+        return _iso_date_repl(match)
+    if rule == "age":
+        # Rule 5: Fix age formatting (74-YEARS-old -> 74-year-old)
+        return match.group(0)[: -len("-YEARS-old")] + "-year-old"
+    if rule == "race":
+        # Rule 6: Fix race/ethnicity casing (all caps -> Title Case)
+        return _after_sae_of(match, _RACE_MAP[match.group("race")])
+    # Rule 7: Lowercase preferred terms after "SAE of"
+    return _after_sae_of(match, match.group(0))
+
+
 class NarrativeGenerator:
     """Template-driven narrative generator."""
 
@@ -38,19 +198,31 @@ class NarrativeGenerator:
         self.templates = self._load_templates(self.template_config_path)
         self.field_mapper = field_mapper or FieldMapper(db_path=FM_DB_PATH)
         self.enhancer = enhancer
+        # Template choice depends only on the three seriousness flags.
+        self._template_cache: Dict[Tuple[Any, Any, Any], Dict[str, Any]] = {}
 
     @staticmethod
     def _load_templates(path: Path) -> Dict[str, Any]:
-        with path.open("r", encoding="utf-8") as handle:
-            return json.load(handle)
+        return _load_templates_cached(path.resolve())
 
     def select_template(self, event_data: Dict[str, Any]) -> Dict[str, Any]:
         """Select template based on event flags with fallback logic."""
-        # Normalize event data - handle None values
-        serious = (event_data.get("serious_event") or "").upper()
-        hosp = (event_data.get("hospitalization") or "").upper()
-        med_imp = (event_data.get("other_medically_important") or "").upper()
-        
+        # Keyed on the raw flag values, so a hit costs one tuple and one dict
+        # lookup; only unseen combinations are normalized and matched.
+        key = (
+            event_data.get("serious_event"),
+            event_data.get("hospitalization"),
+            event_data.get("other_medically_important"),
+        )
+        template = self._template_cache.get(key)
+        if template is None:
+            # Normalize event data - handle None values
+            template = self._template_cache[key] = self._match_template(
+                *((flag or "").upper() for flag in key)
+            )
+        return template
+
+    def _match_template(self, serious: str, hosp: str, med_imp: str) -> Dict[str, Any]:
         # Priority 1: Hospitalization SAE
         if serious == "Y" and hosp == "Y":
             template = self.templates.get("sae_hospitalization")
@@ -107,71 +279,20 @@ class NarrativeGenerator:
 
     def fill_template(self, template_text: str, field_values: Dict[str, Any]) -> str:
         """Replace placeholders in template with safe handling of missing values."""
-        # Convert None and empty strings to placeholder text
-        safe_dict = _SafeDict({
-            key: (
-                value if value not in (None, "", "nan", "NaN") 
-                else "[NOT AVAILABLE]"
-            )
-            for key, value in field_values.items()
-        })
-        formatter = Formatter()
+        safe_dict = _SafeDict(field_values)
+        compiled = _compile_template(template_text)
         try:
-            return formatter.vformat(template_text, (), safe_dict)
+            if compiled is None:
+                return template_text.format_map(safe_dict)
+            format_string, fields = compiled
+            return format_string % tuple([safe_dict[field] for field in fields])
         except KeyError as e:
             LOGGER.error("Missing field in template: %s. Available fields: %s", e, list(field_values.keys()))
             raise ValueError(f"Template requires field {e} which is not available in data") from e
 
     def apply_business_rules(self, text: str) -> str:
         """Apply narrative business rules."""
-        # Rule 1: enforce "most recent dose"
-        text = re.sub(r"\blast dose\b", "most recent dose", text, flags=re.IGNORECASE)
-
-        # Rule 2: normalize ISO dates to DD-MMM-YYYY
-        def _date_repl(match: re.Match[str]) -> str:
-            raw = match.group(0)
-            try:
-                parsed = datetime.strptime(raw, "%Y-%m-%d")
-                return parsed.strftime("%d-%b-%Y")
-            except ValueError:
-                return raw
-
-        text = re.sub(r"\b\d{4}-\d{2}-\d{2}\b", _date_repl, text)
-
-        # Rule 3: lowercase action_taken clause
-        text = re.sub(
-            r"(action taken with study drug was )([^\.]+)",
-            lambda m: m.group(1) + m.group(2).lower(),
-            text,
-            flags=re.IGNORECASE,
-        )
-
-        # Rule 4: lowercase causality clause
-        text = re.sub(
-            r"(assessed the event as )([^\.]+)",
-            lambda m: m.group(1) + m.group(2).lower(),
-            text,
-            flags=re.IGNORECASE,
-        )
-        
-        # Rule 5: Fix age formatting (74-YEARS-old -> 74-year-old)
-        text = re.sub(r"(\d+)-YEARS-old", r"\1-year-old", text, flags=re.IGNORECASE)
-        
-        # Rule 6: Fix race/ethnicity casing (all caps -> Title Case)
-        text = re.sub(r"\bWHITE\b", "White", text)
-        text = re.sub(r"\bBLACK OR AFRICAN AMERICAN\b", "Black or African American", text)
-        text = re.sub(r"\bASIAN\b", "Asian", text)
-        text = re.sub(r"\bNOT HISPANIC OR LATINO\b", "Not Hispanic or Latino", text)
-        text = re.sub(r"\bHISPANIC OR LATINO\b", "Hispanic or Latino", text)
-        
-        # Rule 7: Lowercase preferred terms after "SAE of"
-        text = re.sub(
-            r"(SAE of )([A-Z])",
-            lambda m: m.group(1) + m.group(2).lower(),
-            text
-        )
-
-        return text
+        return _BUSINESS_RULES_RE.sub(_business_rule_repl, text)
 
     def generate_paragraph(
         self, paragraph_config: Dict[str, Any], field_values: Dict[str, Any]
@@ -183,25 +304,20 @@ class NarrativeGenerator:
             key = "with_end_date" if field_values.get("end_date") else "without_end_date"
             variation_text = variations.get(key)
             if variation_text:
-                template_text = f"{base_template} {variation_text}"
+                template_text = _with_variation(base_template, variation_text)
         filled = self.fill_template(template_text, field_values)
         return self.apply_business_rules(filled)
 
-    def generate_narrative(self, subject_id: str, sequence_number: int) -> str:
-        field_values = self.field_mapper.map_all_fields(subject_id, sequence_number)
-        event_data = self.field_mapper.get_event_data(subject_id, sequence_number) or {}
-        template = self.select_template(event_data)
-        paragraphs: List[str] = []
-        for paragraph in sorted(template["paragraphs"], key=lambda p: p["number"]):
-            paragraph_text = self.generate_paragraph(paragraph, field_values)
-            paragraphs.append(paragraph_text)
-            LOGGER.debug(
-                "Generated paragraph %s for subject %s seq %s",
-                paragraph["number"],
-                subject_id,
-                sequence_number,
-            )
-        narrative_text = "\n\n".join(paragraphs)
+    def generate_narrative(
+        self,
+        subject_id: str,
+        sequence_number: int,
+        field_values: Optional[Dict[str, Any]] = None,
+    ) -> str:
+        """Generate one narrative; pass ``field_values`` if already mapped."""
+        field_values, template, narrative_text = self._build_baseline(
+            subject_id, sequence_number, field_values
+        )
         if self.enhancer:
             LOGGER.info(
                 "Enhancing narrative for subject %s seq %s via OpenAI.",
@@ -215,6 +331,128 @@ class NarrativeGenerator:
             )
         return narrative_text
 
+    def generate_narrative_stream(
+        self, subject_id: str, sequence_number: int
+    ) -> Iterator[str]:
+        """Yield the narrative incrementally when the enhancer can stream.
+
+        Without a streaming enhancer the complete narrative is yielded once.
+        """
+        if self.enhancer is None or not hasattr(self.enhancer, "enhance_stream"):
+            yield self.generate_narrative(subject_id, sequence_number)
+            return
+        field_values, template, narrative_text = self._build_baseline(
+            subject_id, sequence_number
+        )
+        LOGGER.info(
+            "Streaming narrative for subject %s seq %s via OpenAI.",
+            subject_id,
+            sequence_number,
+        )
+        yield from self.enhancer.enhance_stream(
+            field_values=field_values,
+            template_id=template["template_id"],
+            baseline_text=narrative_text,
+        )
+
+    def generate_many(
+        self, events: Sequence[Tuple[str, int]], max_concurrency: int = 8
+    ) -> List[Tuple[str, str]]:
+        """Generate ``(narrative_text, template_id)`` for each event, in order.
+
+        Templating runs serially. When the enhancer supports
+        ``enhance_batch``, each subject's events share batched requests (one
+        guide-bearing prompt for several events), with up to
+        ``max_concurrency`` subjects in flight; otherwise ``enhance_many``
+        runs one concurrent request per event.
+        """
+        if hasattr(self.field_mapper, "batch_map"):
+            mapped = self.field_mapper.batch_map(events).to_dict("records")
+        else:
+            mapped = [None] * len(events)
+        baselines = [
+            self._build_baseline(subject_id, sequence_number, field_values)
+            for (subject_id, sequence_number), field_values in zip(events, mapped)
+        ]
+        template_ids = [template["template_id"] for _, template, _ in baselines]
+        if not self.enhancer:
+            texts = [narrative_text for _, _, narrative_text in baselines]
+            return list(zip(texts, template_ids))
+        jobs = [
+            (field_values, template["template_id"], narrative_text)
+            for field_values, template, narrative_text in baselines
+        ]
+        if hasattr(self.enhancer, "enhance_batch"):
+            texts = self._enhance_by_subject(events, jobs, max_concurrency)
+        elif hasattr(self.enhancer, "enhance_many"):
+            texts = self.enhancer.enhance_many(jobs, max_concurrency=max_concurrency)
+        else:
+            texts = [
+                self.enhancer.enhance(
+                    field_values=field_values,
+                    template_id=template_id,
+                    baseline_text=narrative_text,
+                )
+                for field_values, template_id, narrative_text in jobs
+            ]
+        return list(zip(texts, template_ids))
+
+    def _enhance_by_subject(
+        self,
+        events: Sequence[Tuple[str, int]],
+        jobs: Sequence[Tuple[Dict[str, Any], str, str]],
+        max_concurrency: int,
+    ) -> List[str]:
+        """Run ``enhance_batch`` once per subject; return texts in job order."""
+        groups: Dict[str, List[int]] = {}
+        for index, (subject_id, _) in enumerate(events):
+            groups.setdefault(subject_id, []).append(index)
+        indices = list(groups.values())
+        LOGGER.info(
+            "Enhancing %d narratives for %d subjects via OpenAI batches.",
+            len(jobs),
+            len(indices),
+        )
+        texts: List[str] = [""] * len(jobs)
+        workers = max(1, min(max_concurrency, len(indices)))
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            batches = executor.map(
+                lambda group: self.enhancer.enhance_batch([jobs[i] for i in group]),
+                indices,
+            )
+            for group, batch in zip(indices, batches):
+                for index, text in zip(group, batch):
+                    texts[index] = text
+        return texts
+
+    def _build_baseline(
+        self,
+        subject_id: str,
+        sequence_number: int,
+        field_values: Optional[Dict[str, Any]] = None,
+    ) -> Tuple[Dict[str, Any], Dict[str, Any], str]:
+        """Return mapped fields, selected template and template-only narrative.
+
+        ``field_values`` may be passed in when already mapped in bulk.
+        """
+        if field_values is None:
+            field_values = self.field_mapper.map_all_fields(subject_id, sequence_number)
+        event_data = self.field_mapper.get_event_data(subject_id, sequence_number) or {}
+        template = self.select_template(event_data)
+        paragraphs: List[str] = []
+        debug = LOGGER.isEnabledFor(logging.DEBUG)
+        for paragraph in template["paragraphs"]:
+            paragraph_text = self.generate_paragraph(paragraph, field_values)
+            paragraphs.append(paragraph_text)
+            if debug:
+                LOGGER.debug(
+                    "Generated paragraph %s for subject %s seq %s",
+                    paragraph["number"],
+                    subject_id,
+                    sequence_number,
+                )
+        return field_values, template, "\n\n".join(paragraphs)
+
     @staticmethod
     def save_to_database(
         subject_id: str,
@@ -222,31 +460,104 @@ class NarrativeGenerator:
         narrative_text: str,
         template_id: str,
         db_path: Path | str = FM_DB_PATH,
+        *,
+        conn: Optional[sqlite3.Connection] = None,
     ) -> int:
-        """Persist generated narrative to SQLite."""
-        db_path = Path(db_path)
-        timestamp = datetime.utcnow().isoformat()
-        with sqlite3.connect(db_path) as conn:
-            conn.execute(
+        """Persist generated narrative to SQLite.
+
+        Pass ``conn`` to reuse an open connection; otherwise one is opened
+        on ``db_path`` for this call.
+        """
+        if conn is None:
+            with closing(sqlite3.connect(Path(db_path))) as owned_conn:
+                return NarrativeGenerator._insert_narrative(
+                    owned_conn, subject_id, sequence_number, narrative_text, template_id
+                )
+        return NarrativeGenerator._insert_narrative(
+            conn, subject_id, sequence_number, narrative_text, template_id
+        )
+
+    @staticmethod
+    def _insert_narrative(
+        conn: sqlite3.Connection,
+        subject_id: str,
+        sequence_number: int,
+        narrative_text: str,
+        template_id: str,
+    ) -> int:
+        timestamp = _utc_timestamp()
+        with conn:
+            cursor = conn.execute(
                 """
                 INSERT INTO narratives (subject_id, sequence_number, narrative_text, generation_date, template_used)
                 VALUES (?, ?, ?, ?, ?)
                 """,
                 (subject_id, sequence_number, narrative_text, timestamp, template_id),
             )
-            narrative_id = conn.execute("SELECT last_insert_rowid()").fetchone()[0]
-            LOGGER.info(
-                "Saved narrative %s for subject %s seq %s",
-                narrative_id,
-                subject_id,
-                sequence_number,
-            )
-            return narrative_id
+        narrative_id = cursor.lastrowid
+        LOGGER.info(
+            "Saved narrative %s for subject %s seq %s",
+            narrative_id,
+            subject_id,
+            sequence_number,
+        )
+        return narrative_id
+
+    @staticmethod
+    def save_many(
+        rows: Iterable[Tuple[str, int, str, str]],
+        conn: Optional[sqlite3.Connection] = None,
+        db_path: Path | str = FM_DB_PATH,
+        *,
+        generation_date: Optional[str] = None,
+    ) -> int:
+        """Insert ``(subject_id, sequence, text, template_id)`` rows.
+
+        Every row shares one ``generation_date``, stamped once per batch when
+        not given. With ``conn`` the caller owns the transaction; otherwise a
+        connection with the performance PRAGMAs is opened on ``db_path`` and
+        the whole batch commits as one transaction.
+        """
+        if conn is None:
+            with closing(sqlite3.connect(Path(db_path))) as owned_conn:
+                apply_pragmas(owned_conn)
+                with owned_conn:
+                    return NarrativeGenerator.save_many(
+                        rows, owned_conn, generation_date=generation_date
+                    )
+        timestamp = generation_date or _utc_timestamp()
+        cursor = conn.executemany(
+            """
+            INSERT INTO narratives (subject_id, sequence_number, narrative_text, template_used, generation_date)
+            VALUES (?, ?, ?, ?, ?)
+            """,
+            ((*row, timestamp) for row in rows),
+        )
+        LOGGER.info("Saved %d narratives", cursor.rowcount)
+        return cursor.rowcount
 
 
-class _SafeDict(dict):
-    def __missing__(self, key: str) -> str:  # pragma: no cover - simple helper
-        return "[NOT AVAILABLE]"
+def _utc_timestamp() -> str:
+    return datetime.now(timezone.utc).isoformat(timespec="seconds")
+
+
+class _SafeDict:
+    """Uncopied view of field values for ``str.format_map``.
+
+    Absent keys and missing values (None, empty string, "nan") are rendered
+    as ``[NOT AVAILABLE]`` only when a placeholder actually looks them up.
+    """
+
+    __slots__ = ("_values",)
+
+    def __init__(self, values: Dict[str, Any]) -> None:
+        self._values = values
+
+    def __getitem__(self, key: str) -> Any:
+        value = self._values.get(key)
+        if value in _MISSING_VALUES:
+            return "[NOT AVAILABLE]"
+        return value
 
 
 def _parse_args() -> argparse.Namespace:
@@ -269,6 +580,10 @@ def _parse_args() -> argparse.Namespace:
 
 
 def main() -> None:
+    logging.basicConfig(
+        level=logging.INFO,
+        format="%(asctime)s [%(levelname)s] %(name)s - %(message)s",
+    )
     args = _parse_args()
     mapper = FieldMapper(db_path=args.db_path)
     generator = NarrativeGenerator(template_config_path=args.templates, field_mapper=mapper)
@@ -2,9 +2,14 @@
 
 from __future__ import annotations
 
+import json
+import logging
 import sqlite3
 import sys
 import traceback
+from collections import Counter, defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
 from pathlib import Path
 
 PROJECT_ROOT = Path(__file__).resolve().parent
@@ -21,6 +26,122 @@ from document_generator import DocumentGenerator
 
 import tempfile
 
+AUDIT_WORKERS = 8
+
+
+def _print_failure(f):
+    """Print one failed AE as soon as it is seen."""
+    print(f"\n  FAILURE - Subject: {f['subject_id']}, Seq: {f['sequence_number']}, "
+          f"PT: {f['preferred_term']}")
+    print(f"  Serious: {f['serious_event']}, Hosp: {f['hospitalization']}, "
+          f"Med Imp: {f['other_medically_important']}")
+    print(f"  ERROR: {f['error']}")
+    # Print just the last few lines of traceback
+    tb_lines = f['traceback'].strip().split('\n')
+    for line in tb_lines[-4:]:
+        print(f"    {line}")
+
+
+def _print_warning(w):
+    """Print one AE that generated with quality issues as soon as it is seen."""
+    print(f"\n  WARNING - Subject: {w['subject_id']}, Seq: {w['sequence_number']}, "
+          f"PT: {w['preferred_term']}")
+    print(f"  Serious: {w['serious_event']}, Hosp: {w['hospitalization']}, "
+          f"Med Imp: {w['other_medically_important']}, TE: {w['treatment_emergent']}")
+    print(f"  Words: {w['narrative_length']}, Paragraphs: {w['paragraph_count']}")
+    if w['missing_fields']:
+        print(f"  Missing DB fields: {w['missing_fields']}")
+    for issue in w['issues']:
+        print(f"    -> {issue}")
+
+
+def _process_one(row, fields_by_event, generator, doc_gen, output_dir):
+    """Generate, check and write the document for one AE; return its result dict."""
+    subject_id, seq, pt, serious, hosp, med_imp, te = row
+    result = {
+        "subject_id": subject_id,
+        "sequence_number": seq,
+        "preferred_term": pt,
+        "serious_event": serious,
+        "hospitalization": hosp,
+        "other_medically_important": med_imp,
+        "treatment_emergent": te,
+    }
+
+    try:
+        # Step A: Field mapping
+        fields = fields_by_event[(subject_id, seq)]
+
+        # Step B: Check for critical missing fields
+        missing_fields = []
+        for key in ["age", "sex", "race", "ethnicity", "first_dose_date",
+                    "last_dose_date", "start_date", "preferred_term",
+                    "outcome", "action_taken", "causality"]:
+            val = fields.get(key)
+            if val is None or str(val).strip() == "" or str(val) == "nan":
+                missing_fields.append(key)
+
+        # Step C: Generate narrative
+        narrative = generator.generate_narrative(subject_id, seq, fields)
+
+        # Step D: Quality checks (lower-case and split the text only once)
+        issues = []
+        lower = narrative.lower()
+        words = lower.split()
+
+        # Check for unresolved placeholders
+        if "{" in narrative:
+            issues.append("UNRESOLVED_PLACEHOLDERS: narrative contains '{' characters")
+
+        # Check for [NOT AVAILABLE] markers
+        not_avail_count = narrative.count("[NOT AVAILABLE]")
+        if not_avail_count > 0:
+            issues.append(f"NOT_AVAILABLE: {not_avail_count} fields show [NOT AVAILABLE]")
+
+        # Check minimum paragraph count
+        para_count = narrative.count("\n\n") + 1
+        if para_count < 4:
+            issues.append(f"LOW_PARAGRAPH_COUNT: only {para_count} paragraphs (expected >= 5)")
+
+        # Check for "most recent dose" (business rule)
+        if "most recent dose" not in lower and "last dose" in lower:
+            issues.append("BUSINESS_RULE: 'last dose' used instead of 'most recent dose'")
+
+        # Check narrative length (should be meaningful)
+        word_count = len(words)
+        if word_count < 50:
+            issues.append(f"TOO_SHORT: only {word_count} words")
+
+        # Check for None/nan appearing literally in text
+        if "None" in narrative or "nan" in words:
+            issues.append("LITERAL_NONE_OR_NAN: 'None' or 'nan' appears in narrative text")
+
+        # Step E: Try generating Word document
+        doc_path = output_dir / f"narrative_{subject_id}_{seq}.docx"
+        doc_gen.create_narrative_document(narrative, subject_id, seq, doc_path)
+
+        if not doc_path.exists():
+            issues.append("DOC_GENERATION_FAILED: Word document not created")
+
+        # Record result
+        result["narrative_length"] = word_count
+        result["paragraph_count"] = para_count
+        result["missing_fields"] = missing_fields
+        result["not_available_count"] = not_avail_count
+
+        if issues:
+            result["status"] = "warning"
+            result["issues"] = issues
+        else:
+            result["status"] = "success"
+
+    except Exception as e:
+        result["status"] = "failure"
+        result["error"] = str(e)
+        result["traceback"] = traceback.format_exc()
+
+    return result
+
 
 def run_full_patient_audit():
     """Try to generate a narrative for every AE in adae.xlsx and report issues."""
@@ -29,6 +150,7 @@ def run_full_patient_audit():
     tmp_dir = Path(tempfile.mkdtemp(prefix="narrative_audit_"))
     db_path = tmp_dir / "narratives.db"
     output_dir = tmp_dir / "output"
+    report_path = tmp_dir / "audit_report.jsonl"
     output_dir.mkdir(parents=True, exist_ok=True)
 
     print(f"Working directory: {tmp_dir}")
@@ -53,94 +175,43 @@ def run_full_patient_audit():
     print("=" * 100)
 
     # 3. Try generating narratives for each
-    mapper = FieldMapper(db_path=db_path)
+    # Read-only and usable from any thread; the workers below share it.
+    mapper = FieldMapper.readonly(db_path=db_path)
+    # Map every AE up front in one bulk sweep; each narrative is then built
+    # from these fields and the prefetched rows, without further SQL.
+    fields_by_event = mapper.map_all_fields_batch([(row[0], row[1]) for row in all_events])
     generator = NarrativeGenerator(field_mapper=mapper)
     doc_gen = DocumentGenerator()
 
-    successes = []
-    failures = []
-    warnings = []  # Narratives that generate but have quality issues
-
-    for idx, (subject_id, seq, pt, serious, hosp, med_imp, te) in enumerate(all_events, 1):
-        result = {
-            "subject_id": subject_id,
-            "sequence_number": seq,
-            "preferred_term": pt,
-            "serious_event": serious,
-            "hospitalization": hosp,
-            "other_medically_important": med_imp,
-            "treatment_emergent": te,
-        }
-
-        try:
-            # Step A: Field mapping
-            fields = mapper.map_all_fields(subject_id, seq)
-
-            # Step B: Check for critical missing fields
-            missing_fields = []
-            for key in ["age", "sex", "race", "ethnicity", "first_dose_date",
-                        "last_dose_date", "start_date", "preferred_term",
-                        "outcome", "action_taken", "causality"]:
-                val = fields.get(key)
-                if val is None or str(val).strip() == "" or str(val) == "nan":
-                    missing_fields.append(key)
-
-            # Step C: Generate narrative
-            narrative = generator.generate_narrative(subject_id, seq)
-
-            # Step D: Quality checks
-            issues = []
-
-            # Check for unresolved placeholders
-            if "{" in narrative:
-                issues.append("UNRESOLVED_PLACEHOLDERS: narrative contains '{' characters")
-
-            # Check for [NOT AVAILABLE] markers
-            not_avail_count = narrative.count("[NOT AVAILABLE]")
-            if not_avail_count > 0:
-                issues.append(f"NOT_AVAILABLE: {not_avail_count} fields show [NOT AVAILABLE]")
-
-            # Check minimum paragraph count
-            para_count = narrative.count("\n\n") + 1
-            if para_count < 4:
-                issues.append(f"LOW_PARAGRAPH_COUNT: only {para_count} paragraphs (expected >= 5)")
-
-            # Check for "most recent dose" (business rule)
-            if "most recent dose" not in narrative.lower() and "last dose" in narrative.lower():
-                issues.append("BUSINESS_RULE: 'last dose' used instead of 'most recent dose'")
-
-            # Check narrative length (should be meaningful)
-            word_count = len(narrative.split())
-            if word_count < 50:
-                issues.append(f"TOO_SHORT: only {word_count} words")
-
-            # Check for None/nan appearing literally in text
-            if "None" in narrative or "nan" in narrative.lower().split():
-                issues.append("LITERAL_NONE_OR_NAN: 'None' or 'nan' appears in narrative text")
-
-            # Step E: Try generating Word document
-            doc_path = output_dir / f"narrative_{subject_id}_{seq}.docx"
-            doc_gen.create_narrative_document(narrative, subject_id, seq, doc_path)
-
-            if not doc_path.exists():
-                issues.append("DOC_GENERATION_FAILED: Word document not created")
-
-            # Record result
-            result["narrative_length"] = word_count
-            result["paragraph_count"] = para_count
-            result["missing_fields"] = missing_fields
-            result["not_available_count"] = not_avail_count
-
-            if issues:
-                result["issues"] = issues
-                warnings.append(result)
-            else:
-                successes.append(result)
-
-        except Exception as e:
-            result["error"] = str(e)
-            result["traceback"] = traceback.format_exc()
-            failures.append(result)
+    # Results are streamed to the report file as they are produced; only
+    # counters and a small success sample are kept for the summary.
+    counters = Counter()
+    issue_counts = Counter()
+    patient_stats = defaultdict(Counter)
+    success_sample = []
+
+    with report_path.open("w", encoding="utf-8") as report:
+        with ThreadPoolExecutor(max_workers=AUDIT_WORKERS) as executor:
+            process = partial(
+                _process_one,
+                fields_by_event=fields_by_event,
+                generator=generator,
+                doc_gen=doc_gen,
+                output_dir=output_dir,
+            )
+            # executor.map yields in submission order, so the report stays sorted.
+            for result in executor.map(process, all_events):
+                if result["status"] == "warning":
+                    issue_counts.update(issue.split(":")[0] for issue in result["issues"])
+                    _print_warning(result)
+                elif result["status"] == "failure":
+                    _print_failure(result)
+                elif len(success_sample) < 5:
+                    success_sample.append(result)
+
+                counters[result["status"]] += 1
+                patient_stats[result["subject_id"]][result["status"]] += 1
+                report.write(json.dumps(result) + "\n")
 
     mapper.close()
 
@@ -150,61 +221,25 @@ def run_full_patient_audit():
     print("=" * 100)
 
     print(f"\nTotal AEs: {total}")
-    print(f"  Successes (clean):     {len(successes)}")
-    print(f"  Warnings (generated but issues): {len(warnings)}")
-    print(f"  Failures (exceptions): {len(failures)}")
-
-    # --- Failures ---
-    if failures:
-        print("\n" + "-" * 100)
-        print(f"FAILURES ({len(failures)}):")
-        print("-" * 100)
-        for f in failures:
-            print(f"\n  Subject: {f['subject_id']}, Seq: {f['sequence_number']}, "
-                  f"PT: {f['preferred_term']}")
-            print(f"  Serious: {f['serious_event']}, Hosp: {f['hospitalization']}, "
-                  f"Med Imp: {f['other_medically_important']}")
-            print(f"  ERROR: {f['error']}")
-            # Print just the last few lines of traceback
-            tb_lines = f['traceback'].strip().split('\n')
-            for line in tb_lines[-4:]:
-                print(f"    {line}")
+    print(f"  Successes (clean):     {counters['success']}")
+    print(f"  Warnings (generated but issues): {counters['warning']}")
+    print(f"  Failures (exceptions): {counters['failure']}")
+    print(f"  Full per-AE report: {report_path}")
 
     # --- Warnings ---
-    if warnings:
+    if issue_counts:
         print("\n" + "-" * 100)
-        print(f"WARNINGS ({len(warnings)}):")
+        print(f"WARNINGS ({counters['warning']}) - Issue type summary:")
         print("-" * 100)
-
-        # Group warnings by issue type
-        issue_counts = {}
-        for w in warnings:
-            for issue in w["issues"]:
-                issue_type = issue.split(":")[0]
-                issue_counts[issue_type] = issue_counts.get(issue_type, 0) + 1
-
-        print("\n  Issue type summary:")
-        for issue_type, count in sorted(issue_counts.items(), key=lambda x: -x[1]):
+        for issue_type, count in issue_counts.most_common():
             print(f"    {issue_type}: {count} events")
 
-        print("\n  Detailed warnings:")
-        for w in warnings:
-            print(f"\n  Subject: {w['subject_id']}, Seq: {w['sequence_number']}, "
-                  f"PT: {w['preferred_term']}")
-            print(f"  Serious: {w['serious_event']}, Hosp: {w['hospitalization']}, "
-                  f"Med Imp: {w['other_medically_important']}, TE: {w['treatment_emergent']}")
-            print(f"  Words: {w['narrative_length']}, Paragraphs: {w['paragraph_count']}")
-            if w['missing_fields']:
-                print(f"  Missing DB fields: {w['missing_fields']}")
-            for issue in w['issues']:
-                print(f"    -> {issue}")
-
     # --- Success sample ---
-    if successes:
+    if success_sample:
         print("\n" + "-" * 100)
-        print(f"SUCCESSES ({len(successes)}) - Sample:")
+        print(f"SUCCESSES ({counters['success']}) - Sample:")
         print("-" * 100)
-        for s in successes[:5]:
+        for s in success_sample:
             print(f"  Subject: {s['subject_id']}, Seq: {s['sequence_number']}, "
                   f"PT: {s['preferred_term']}, Words: {s['narrative_length']}, "
                   f"Paragraphs: {s['paragraph_count']}")
@@ -214,24 +249,11 @@ def run_full_patient_audit():
     print("PER-PATIENT SUMMARY:")
     print("-" * 100)
 
-    # Group by subject
-    from collections import defaultdict
-    patient_stats = defaultdict(lambda: {"total": 0, "success": 0, "warning": 0, "failure": 0})
-    for s in successes:
-        patient_stats[s["subject_id"]]["total"] += 1
-        patient_stats[s["subject_id"]]["success"] += 1
-    for w in warnings:
-        patient_stats[w["subject_id"]]["total"] += 1
-        patient_stats[w["subject_id"]]["warning"] += 1
-    for f in failures:
-        patient_stats[f["subject_id"]]["total"] += 1
-        patient_stats[f["subject_id"]]["failure"] += 1
-
     print(f"\n  {'Subject ID':<35} {'Total':>6} {'OK':>6} {'Warn':>6} {'Fail':>6}")
     print(f"  {'-'*35} {'-'*6} {'-'*6} {'-'*6} {'-'*6}")
     for subj in sorted(patient_stats.keys()):
         stats = patient_stats[subj]
-        print(f"  {subj:<35} {stats['total']:>6} {stats['success']:>6} "
+        print(f"  {subj:<35} {sum(stats.values()):>6} {stats['success']:>6} "
               f"{stats['warning']:>6} {stats['failure']:>6}")
 
     # --- Generated docs count ---
@@ -244,4 +266,9 @@ def run_full_patient_audit():
 
 
 if __name__ == "__main__":
+    # Per-AE INFO logs would drown the report; keep warnings and errors only.
+    logging.basicConfig(
+        level=logging.WARNING,
+        format="%(asctime)s [%(levelname)s] %(name)s - %(message)s",
+    )
     run_full_patient_audit()
@@ -2,9 +2,12 @@
 
 from __future__ import annotations
 
+import json
+import re
 import sqlite3
 import sys
 from pathlib import Path
+from types import SimpleNamespace
 
 import pandas as pd
 import pytest
@@ -16,6 +19,7 @@ if str(SRC_DIR) not in sys.path:
 
 from data_loader import DEFAULT_EXCEL_PATH  # noqa: E402
 from field_mapper import FieldMapper  # noqa: E402
+from ai_enhancer import OpenAINarrativeEnhancer  # noqa: E402
 from main import (  # noqa: E402
     generate_all_saes,
     generate_single_narrative,
@@ -77,6 +81,62 @@ def test_field_mapping(temp_environment):
     assert fields["end_date"] == "25-Jan-2024"
 
 
+def test_batch_map(temp_environment):
+    """Column-wise batch mapping matches per-event mapping, misses included."""
+    events = [("C-906289-002-0422-001", 17), ("C-906289-002-0422-001", 9999)]
+    mapper = FieldMapper(db_path=temp_environment["db_path"])
+    expected = [mapper.map_all_fields(*event) for event in events]
+    batch = mapper.batch_map(events).to_dict("records")
+    keyed = mapper.map_all_fields_batch(events)
+    mapper.close()
+
+    assert batch == expected
+    assert keyed == dict(zip(events, expected))
+
+
+def test_batch_map_out_of_range_dates(temp_environment, tmp_path):
+    """Dates outside pandas' Timestamp range format like map_all_fields."""
+    db_path = tmp_path / "narratives.db"
+    with sqlite3.connect(temp_environment["db_path"]) as source, sqlite3.connect(db_path) as copy:
+        source.backup(copy)
+        copy.execute(
+            "UPDATE adverse_events SET start_date = '1500-03-04', end_date = '2400-12-31' "
+            "WHERE subject_id = ? AND sequence_number = ?",
+            ("C-906289-002-0422-001", 17),
+        )
+    event = ("C-906289-002-0422-001", 17)
+    mapper = FieldMapper(db_path=db_path)
+    expected = mapper.map_all_fields(*event)
+    batch = mapper.batch_map([event]).to_dict("records")
+    mapper.close()
+
+    assert expected["start_date"] == "04-Mar-1500"
+    assert expected["end_date"] == "31-Dec-2400"
+    assert batch == [expected]
+
+
+def test_stale_field_plan_cache(temp_environment, tmp_path):
+    """A foreign or corrupt plan pickle is rebuilt instead of failing."""
+    from field_mapper import DEFAULT_CONFIG_PATH
+
+    config_path = tmp_path / "field_mappings.json"
+    config_path.write_text(DEFAULT_CONFIG_PATH.read_text(encoding="utf-8"), encoding="utf-8")
+    # Pickle referencing a module that no longer exists (old FieldPlan layout).
+    config_path.with_suffix(".plan.pkl").write_bytes(b"cno_such_module\nFieldPlan\n.")
+    mapper = FieldMapper(config_path=config_path, db_path=temp_environment["db_path"])
+    fields = mapper.map_all_fields("C-906289-002-0422-001", 17)
+    mapper.close()
+    rebuilt, plan = FieldMapper._load_cached_plan(config_path)
+
+    assert fields["preferred_term"]
+    assert plan == FieldMapper._compile_field_plan(rebuilt)
+    # The rewritten cache was renamed into place; no temp file is left behind.
+    assert sorted(path.name for path in tmp_path.iterdir()) == [
+        "field_mappings.json",
+        "field_mappings.plan.pkl",
+    ]
+
+
 def test_template_selection(temp_environment):
     """Ensure correct templates are selected based on flags."""
     mapper = FieldMapper(db_path=temp_environment["db_path"])
@@ -117,6 +177,29 @@ def test_narrative_generation(temp_environment):
     assert "action taken with study drug was" in narrative.lower()
 
 
+def test_business_rules(temp_environment):
+    """The single-pass rewriter applies every rule, including nested ones."""
+    mapper = FieldMapper(db_path=temp_environment["db_path"])
+    generator = NarrativeGenerator(field_mapper=mapper)
+    mapper.close()
+
+    text = (
+        "A 74-YEARS-old WHITE NOT HISPANIC OR LATINO male had an SAE of Nausea "
+        "on 2024-01-22 after the last dose. Action taken with study drug was "
+        "DRUG INTERRUPTED on 2024-01-23. The investigator assessed the event as "
+        "RELATED. SAE of WHITE count."
+    )
+    assert generator.apply_business_rules(text) == (
+        "A 74-year-old White Not Hispanic or Latino male had an SAE of nausea "
+        "on 22-Jan-2024 after the most recent dose. Action taken with study drug was "
+        "drug interrupted on 23-jan-2024. The investigator assessed the event as "
+        "related. SAE of white count."
+    )
+    # As a separate pass, Rule 7 skipped every other "SAE of " in a run.
+    assert generator.apply_business_rules("SAE of SAE of WHITE") == "SAE of sAE of White"
+    assert generator.apply_business_rules("SAE of SAE of SAE of DRUG") == "SAE of sAE of SAE of dRUG"
+
+
 def test_end_to_end(temp_environment):
     """Full workflow: generate narratives, confirm DB + doc outputs."""
     db_path = temp_environment["db_path"]
@@ -164,3 +247,210 @@ def test_openai_enhancer_hook(temp_environment):
     assert enhancer.called is True
     assert narrative.endswith("[Enhanced by OpenAI]")
 
+
+def test_generate_many(temp_environment):
+    """Batch generation keeps event order and reports each template used."""
+    mapper = FieldMapper(db_path=temp_environment["db_path"])
+    generator = NarrativeGenerator(field_mapper=mapper, enhancer=DummyEnhancer())
+    events = [("C-906289-002-0422-001", 17), ("C-906289-002-0422-001", 17)]
+    results = generator.generate_many(events)
+    single = generator.generate_narrative(*events[0])
+    mapper.close()
+
+    assert [text for text, _ in results] == [single, single]
+    assert all(template_id for _, template_id in results)
+
+
+class BatchingEnhancer(DummyEnhancer):
+    """Enhancer exposing ``enhance_batch``; records each batch it receives."""
+
+    def __init__(self):
+        super().__init__()
+        self.batches = []
+
+    def enhance_batch(self, items):
+        self.batches.append([field_values["subject_id"] for field_values, _, _ in items])
+        return [self.enhance(*item) for item in items]
+
+
+def test_generate_many_batches_per_subject(temp_environment):
+    """With ``enhance_batch``, each subject's events share one batch call."""
+    with sqlite3.connect(temp_environment["db_path"]) as conn:
+        rows = conn.execute(
+            "SELECT subject_id, sequence_number FROM adverse_events "
+            "WHERE subject_id IN (SELECT subject_id FROM adverse_events "
+            "GROUP BY subject_id HAVING COUNT(*) > 1 LIMIT 2) "
+            "ORDER BY sequence_number, subject_id"
+        ).fetchall()
+    events = [tuple(row) for row in rows]
+    mapper = FieldMapper(db_path=temp_environment["db_path"])
+    enhancer = BatchingEnhancer()
+    generator = NarrativeGenerator(field_mapper=mapper, enhancer=enhancer)
+    results = generator.generate_many(events, max_concurrency=2)
+    expected = [generator.generate_narrative(*event) for event in events]
+    mapper.close()
+
+    assert [text for text, _ in results] == expected
+    # Events are interleaved across subjects, yet each batch holds one subject.
+    assert len(enhancer.batches) == len({subject for subject, _ in events}) == 2
+    assert all(len(set(batch)) == 1 for batch in enhancer.batches)
+    assert sum(map(len, enhancer.batches)) == len(events)
+
+
+class FakeChatClient:
+    """Minimal stand-in for the OpenAI client returning canned responses."""
+
+    def __init__(self, contents):
+        self.contents = list(contents)
+        self.calls = []
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self._create))
+
+    def _create(self, **kwargs):
+        self.calls.append(kwargs)
+        message = SimpleNamespace(content=self.contents.pop(0))
+        return SimpleNamespace(choices=[SimpleNamespace(message=message)])
+
+
+def test_openai_enhance_batch():
+    """Batch enhancement maps results back by index and falls back per item."""
+    items = [
+        ({"subject_id": "S1"}, "SAE_HOSP_V1", "baseline 0"),
+        ({"subject_id": "S2"}, "SAE_HOSP_V1", "baseline 1"),
+    ]
+    client = FakeChatClient([json.dumps({"0": "narrative 0 ", "1": "narrative 1"})])
+    enhancer = OpenAINarrativeEnhancer(client=client)
+    assert enhancer.enhance_batch(items) == ["narrative 0", "narrative 1"]
+    assert len(client.calls) == 1
+
+    client = FakeChatClient([json.dumps({"0": "narrative 0"}), "retried 1"])
+    enhancer = OpenAINarrativeEnhancer(client=client)
+    assert enhancer.enhance_batch(items) == ["narrative 0", "retried 1"]
+    assert len(client.calls) == 2
+
+
+def test_openai_enhance_batch_token_cap():
+    """Large batches are split so no request exceeds the output-token limit."""
+    items = [({"subject_id": f"S{i}"}, "SAE_HOSP_V1", f"baseline {i}") for i in range(12)]
+    responses = [
+        json.dumps({str(i): f"narrative {i}" for i in range(5)}),
+        json.dumps({str(i): f"narrative {i + 5}" for i in range(5)}),
+        json.dumps({"0": "narrative 10", "1": "narrative 11"}),
+    ]
+    client = FakeChatClient(responses)
+    enhancer = OpenAINarrativeEnhancer(client=client, max_tokens=3000)
+
+    assert enhancer.enhance_batch(items) == [f"narrative {i}" for i in range(12)]
+    assert [call["max_tokens"] for call in client.calls] == [15000, 15000, 6000]
+    assert all(call["max_tokens"] <= enhancer.max_output_tokens for call in client.calls)
+
+
+class FakeStreamClient:
+    """Chat client whose streamed response may break after some chunks."""
+
+    def __init__(self, deltas, fail_after=None):
+        self.deltas = deltas
+        self.fail_after = fail_after
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self._create))
+
+    def _create(self, **kwargs):
+        assert kwargs["stream"] is True
+        for index, delta in enumerate(self.deltas):
+            if index == self.fail_after:
+                raise ConnectionError("connection reset")
+            yield SimpleNamespace(choices=[SimpleNamespace(delta=SimpleNamespace(content=delta))])
+
+
+def test_openai_enhance_stream():
+    """Complete streams are yielded in chunks; interrupted ones are flagged."""
+    from ai_enhancer import STREAM_INTERRUPTED_MARKER
+
+    event = ({"subject_id": "S1"}, "SAE_HOSP_V1", "baseline")
+    client = FakeStreamClient(["Para 1.", "\n\nPara 2."])
+    chunks = list(OpenAINarrativeEnhancer(client=client).enhance_stream(*event))
+    assert chunks == ["Para 1.", "\n\nPara 2."]
+
+    client = FakeStreamClient(["Para 1.", "\n\nPara 2."], fail_after=1)
+    chunks = list(OpenAINarrativeEnhancer(client=client).enhance_stream(*event))
+    assert chunks == ["Para 1.", STREAM_INTERRUPTED_MARKER]
+
+
+def test_openai_enhance_many():
+    """Concurrent enhancement keeps job order and falls back per failed job."""
+
+    def create(**kwargs):
+        subject = re.search(r"\bS\d+\b", kwargs["messages"][1]["content"]).group(0)
+        if subject == "S2":
+            raise RuntimeError("server error")
+        message = SimpleNamespace(content=json.dumps({"demographics": f"About {subject}."}))
+        return SimpleNamespace(choices=[SimpleNamespace(message=message)])
+
+    client = SimpleNamespace(chat=SimpleNamespace(completions=SimpleNamespace(create=create)))
+    jobs = [({"subject_id": f"S{i}"}, "SAE_HOSP_V1", f"baseline {i}") for i in range(5)]
+    results = OpenAINarrativeEnhancer(client=client).enhance_many(jobs, max_concurrency=3)
+
+    assert results == ["About S0.", "About S1.", "baseline 2", "About S3.", "About S4."]
+
+
+class FakeBatchClient:
+    """Stand-in for the OpenAI batches/files API serving one finished batch."""
+
+    def __init__(self, batch, files):
+        self.batches = SimpleNamespace(retrieve=lambda batch_id: batch)
+        self.files = SimpleNamespace(content=lambda file_id: SimpleNamespace(text=files[file_id]))
+
+
+def test_openai_poll_batch(caplog):
+    """Completed batches return successful narratives and log failed requests."""
+    sections = {name: f"{name}." for name in ("demographics", "event_description")}
+    ok = {
+        "custom_id": "S1-1",
+        "response": {
+            "status_code": 200,
+            "body": {"choices": [{"message": {"content": json.dumps(sections)}}]},
+        },
+    }
+    failed = {"custom_id": "S1-2", "response": None, "error": {"message": "bad request"}}
+    batch = SimpleNamespace(
+        status="completed", output_file_id="out", error_file_id="err"
+    )
+    client = FakeBatchClient(batch, {"out": json.dumps(ok), "err": json.dumps(failed)})
+    enhancer = OpenAINarrativeEnhancer(client=client)
+    with caplog.at_level("WARNING", logger="ai_enhancer"):
+        assert enhancer.poll_batch("batch_1") == {
+            "S1-1": "demographics.\n\nevent_description."
+        }
+    assert "S1-2" in caplog.text
+
+    # Every request failed: there is no output file, only the error file.
+    batch = SimpleNamespace(status="completed", output_file_id=None, error_file_id="err")
+    client = FakeBatchClient(batch, {"err": json.dumps(failed)})
+    assert OpenAINarrativeEnhancer(client=client).poll_batch("batch_2") == {}
+
+
+def test_openai_missing_guide_not_cached(tmp_path):
+    """A missing guide is not cached, so adding it later takes effect."""
+    guide_path = tmp_path / "narrative_guide.txt"
+    enhancer = OpenAINarrativeEnhancer(client=FakeChatClient([]), guide_path=guide_path)
+    assert enhancer.narrative_guide == ""
+
+    guide_path.write_text("Use \"most recent dose\".", encoding="utf-8")
+    enhancer = OpenAINarrativeEnhancer(client=FakeChatClient([]), guide_path=guide_path)
+    assert enhancer.narrative_guide == 'Use "most recent dose".'
+
+
+def test_openai_enhance_cache(tmp_path):
+    """Repeated enhancement of the same event is served from the SQLite cache."""
+    sections = {
+        "demographics": "Paragraph 1.",
+        "concomitant_medications": "Paragraph 2.",
+        "study_drug_dosing": "Paragraph 3.",
+        "event_description": "Paragraph 4.",
+        "action_and_causality": "Paragraph 5.",
+    }
+    client = FakeChatClient([json.dumps(sections)])
+    enhancer = OpenAINarrativeEnhancer(client=client, cache_db_path=tmp_path / "cache.db")
+    first = enhancer.enhance({"subject_id": "S1"}, "SAE_HOSP_V1", "baseline")
+    second = enhancer.enhance({"subject_id": "S1"}, "SAE_HOSP_V1", "baseline")
+
+    assert first == second == "\n\n".join(sections.values())
+    assert len(client.calls) == 1